@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Measure how the word filter's cost per message grows with the number of rules.
+
+Run from the repository root:
+
+    python -m benchmarks.filter_rules
+
+Rules are stored in a memory:// database and loaded into a FilterMatcher the
+way the filter cog does, then the same messages are matched against 10 to
+5000 rules of each type.
+"""
+
+import asyncio
+import random
+import string
+import time
+
+from bot.wordfilter import RULE_ACTIONS, WILDCARD, FilterMatcher
+from database import init_dbconn
+
+RULE_COUNTS = (10, 100, 1000, 5000)
+MESSAGES = 2000
+
+
+def random_word(rng: random.Random, shortest: int = 4, longest: int = 10) -> str:
+    return "".join(
+        rng.choices(string.ascii_lowercase, k=rng.randint(shortest, longest))
+    )
+
+
+def random_pattern(rng: random.Random, rule_type: str) -> str:
+    word = random_word(rng)
+    if rule_type == "wildcard":
+        i = rng.randrange(len(word))
+        return word[:i] + WILDCARD + word[i + 1 :]
+    return word
+
+
+def random_message(rng: random.Random) -> str:
+    words = [random_word(rng, 2, 8) for _ in range(rng.randint(3, 20))]
+    if rng.random() < 0.1:
+        words.append(f"discord.gg/{random_word(rng)}")
+    return " ".join(words)
+
+
+async def load_matcher(rule_type: str, count: int, rng: random.Random) -> FilterMatcher:
+    conn = await init_dbconn("memory://")
+    for _ in range(count):
+        await conn.add_filter_rule(
+            rule_type, random_pattern(rng, rule_type), rng.choice(RULE_ACTIONS), 0
+        )
+    # like Filter.load_rules
+    matcher = FilterMatcher()
+    for rule in await conn.get_filter_rules():
+        matcher.add(rule[0], rule[1], rule[2], rule[3])
+    return matcher
+
+
+async def main():
+    rng = random.Random(1)
+    messages = [random_message(rng) for _ in range(MESSAGES)]
+    print(f"{'rules':>8}" + "".join(f"{count:>10}" for count in RULE_COUNTS))
+    for rule_type in ("word", "wildcard", "invite"):
+        costs = []
+        for count in RULE_COUNTS:
+            matcher = await load_matcher(rule_type, count, rng)
+            start = time.perf_counter()
+            for message in messages:
+                matcher.match(message)
+            costs.append((time.perf_counter() - start) / MESSAGES * 1e6)
+        print(
+            f"{rule_type:>8}"
+            + "".join(f"{cost:>8.1f}us" for cost in costs)
+            + f"   {costs[-1] / costs[0]:.1f}x from {RULE_COUNTS[0]} to {RULE_COUNTS[-1]} rules"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Compare the memory of the namedtuple rows with psycopg2's DictRow rows.
+
+Run from the repository root:
+
+    python -m benchmarks.row_memory
+
+Fills a memory:// database through its usual methods, then measures with
+tracemalloc what wrapping the same column values costs per row, as the
+DictRow rows PostgresConn used to return and as the rows module's namedtuples.
+The column values are shared by both, so only the row objects are counted.
+"""
+
+import asyncio
+import datetime
+import tracemalloc
+
+from psycopg2.extras import DictRow
+
+from database import init_dbconn, rows
+
+ROWS = 100000
+
+
+class ColumnIndex:
+    """The parts of a DictCursor a DictRow uses."""
+
+    def __init__(self, columns: tuple):
+        self.index = {column: i for i, column in enumerate(columns)}
+        self.description = columns
+
+
+def dict_rows(row_class, values: list) -> list:
+    cursor = ColumnIndex(row_class._fields)
+    result = []
+    for row_values in values:
+        row = DictRow(cursor)
+        row[:] = row_values
+        result.append(row)
+    return result
+
+
+def allocated(build, values: list) -> float:
+    """Return the bytes per row build allocates to wrap values."""
+    tracemalloc.start()
+    result = build(values)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size / len(values)
+
+
+async def fill(conn):
+    now = datetime.datetime.utcnow()
+    for i in range(ROWS):
+        user_id = 100000000000000000 + i
+        await conn.add_highlight(user_id, f"word{i}")
+        await conn.add_to_mod_logs(user_id, 200000000000000000, "warn", f"reason {i}")
+        await conn.set_pending_action(user_id, "mute", [300000000000000000], [], now)
+
+
+async def main():
+    conn = await init_dbconn("memory://")
+    await fill(conn)
+    for name, row_class, fetch in (
+        ("highlights", rows.Highlight, conn.get_all_highlights),
+        ("modactions", rows.ModAction, conn.export_all),
+        ("pending_actions", rows.PendingAction, conn.get_pending_actions),
+    ):
+        values = [tuple(row) for row in await fetch()]
+        before = allocated(lambda values: dict_rows(row_class, values), values)
+        after = allocated(lambda values: rows.many(row_class, values), values)
+        print(
+            f"{name:<16} DictRow {before:.0f} B/row -> {row_class.__name__} {after:.0f} B/row ({(1 - after / before) * 100:.0f}% less)"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
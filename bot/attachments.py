@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+import aiohttp
+
+CHUNK_SIZE = 64 * 1024
+# how many messages' attachments are downloaded together, bounding how many are held at once
+BATCH_SIZE = 100
+
+
+class ArchiveStats:
+    """What one archive downloaded, for its log line and summary."""
+
+    __slots__ = (
+        "files",
+        "stored",
+        "duplicates",
+        "skipped",
+        "failed",
+        "bytes",
+        "reserved",
+        "started",
+    )
+
+    def __init__(self):
+        self.files = 0
+        self.stored = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+        # bytes promised to downloads that were started, checked against the size cap
+        self.reserved = 0
+        self.started = time.monotonic()
+
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 0.001)
+        return (
+            f"{self.files} attachments, {self.bytes / 1048576:.1f} MiB in {elapsed:.1f}s "
+            f"({self.bytes / 1048576 / elapsed:.2f} MiB/s): {self.stored} stored, "
+            f"{self.duplicates} already stored, {self.skipped} over the size cap, {self.failed} failed"
+        )
+
+
+class AttachmentArchiver:
+    """Downloads attachments into a local content-addressed store.
+
+    Files are streamed to disk in chunks while they're hashed, then stored
+    under their sha256, so the same file attached twice (or archived twice)
+    is only kept once. Downloads share one connection pool, limited to
+    `connections` connections, and each archive stops downloading once it
+    has used up `max_archive_size` bytes.
+    """
+
+    def __init__(self, directory: str, connections: int, max_archive_size: int, logger):
+        self.directory = directory
+        self.max_archive_size = max_archive_size
+        self.logger = logger
+        os.makedirs(os.path.join(directory, "tmp"), exist_ok=True)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=connections)
+        )
+        # also bounds how many partial files are open at once
+        self.downloads = asyncio.Semaphore(connections)
+
+    @classmethod
+    def from_config(cls, bot_config, logger):
+        """Return an archiver for the [attachments] config, or None if archiving is disabled."""
+        # configs from before archiving existed have no [attachments] section
+        config = bot_config.get("attachments", {})
+        if not config.get("store_directory"):
+            return None
+        return cls(
+            config["store_directory"],
+            config.get("connections", 4),
+            config.get("max_archive_size", 100) * 1024 * 1024,
+            logger,
+        )
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    async def archive_messages(self, messages, stats: ArchiveStats):
+        """Yield (message, hashes) for every message, hashes mapping attachment ids to the sha256 they're stored under."""
+        batch = []
+        async for message in messages:
+            batch.append(message)
+            if len(batch) >= BATCH_SIZE:
+                for pair in await self.archive_batch(batch, stats):
+                    yield pair
+                batch = []
+        for pair in await self.archive_batch(batch, stats):
+            yield pair
+
+    async def archive_batch(self, messages: list, stats: ArchiveStats) -> list:
+        attachments = [
+            attachment for message in messages for attachment in message.attachments
+        ]
+        digests = await asyncio.gather(
+            *(self.download(attachment, stats) for attachment in attachments)
+        )
+        hashes = {
+            attachment.id: digest for attachment, digest in zip(attachments, digests)
+        }
+        return [(message, hashes) for message in messages]
+
+    async def download(self, attachment, stats: ArchiveStats) -> str:
+        """Store an attachment, returning its sha256, or None if it was skipped or failed."""
+        stats.files += 1
+        # reserve the size up front, so downloads running together can't overshoot the cap
+        if stats.reserved + attachment.size > self.max_archive_size:
+            stats.skipped += 1
+            return None
+        stats.reserved += attachment.size
+        async with self.downloads:
+            temp_path = None
+            try:
+                fd, temp_path = tempfile.mkstemp(
+                    dir=os.path.join(self.directory, "tmp")
+                )
+                digest = hashlib.sha256()
+                size = 0
+                with os.fdopen(fd, "wb") as f:
+                    async with self.session.get(attachment.url) as response:
+                        response.raise_for_status()
+                        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                            size += len(chunk)
+                            if size > attachment.size:
+                                raise ValueError("larger than its announced size")
+                            digest.update(chunk)
+                            f.write(chunk)
+                stats.bytes += size
+                digest = digest.hexdigest()
+                path = self.path(digest)
+                if os.path.exists(path):
+                    stats.duplicates += 1
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temp_path, path)
+                    stats.stored += 1
+                return digest
+            except (
+                aiohttp.ClientError,
+                asyncio.TimeoutError,
+                ValueError,
+                OSError,
+            ) as e:
+                # OSError is a full or unwritable disk, either way the export links the attachment's url instead
+                stats.failed += 1
+                # nothing was stored, so the rest of the archive can use the space
+                stats.reserved -= attachment.size
+                self.logger.log(
+                    logging.WARN,
+                    f"Couldn't archive attachment {attachment.id} ({attachment.url}): {e!r}",
+                )
+                return None
+            finally:
+                if temp_path and os.path.exists(temp_path):
+                    try:
+                        os.remove(temp_path)
+                    except OSError:
+                        pass
+
+    async def close(self):
+        await self.session.close()
+
+
+async def archive_attachments(
+    archiver: AttachmentArchiver, messages, stats: ArchiveStats
+):
+    """Like AttachmentArchiver.archive_messages, but passes messages through unarchived if archiver is None."""
+    if archiver is None:
+        async for message in messages:
+            yield message, {}
+    else:
+        async for pair in archiver.archive_messages(messages, stats):
+            yield pair
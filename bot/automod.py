@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import heapq
+import logging
+import re
+import time
+
+import discord
+from cachetools import TTLCache
+from discord.ext import commands
+
+from bot.moderation import get_timedelta_from_string
+
+whitespace_match = re.compile(r"\s+")
+
+# shingle length and sketch size for near-duplicate detection
+SHINGLE_LENGTH = 5
+SKETCH_SIZE = 8
+# polynomial rolling hash parameters
+HASH_BASE = 257
+HASH_MOD = (1 << 61) - 1
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+    def take(self, capacity: float, rate: float, now: float) -> bool:
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def sketch(content: str) -> frozenset:
+    """Return a bottom-k sketch of the rolling hashes of all shingles in content.
+
+    Content shorter than a shingle (including attachment-only messages) has no
+    sketch, since short replies like "ok" repeat without being spam.
+    """
+    content = whitespace_match.sub(" ", content.lower()).strip()
+    if len(content) < SHINGLE_LENGTH:
+        return None
+    top = pow(HASH_BASE, SHINGLE_LENGTH - 1, HASH_MOD)
+    h = 0
+    for char in content[:SHINGLE_LENGTH]:
+        h = (h * HASH_BASE + ord(char)) % HASH_MOD
+    hashes = {h}
+    for i in range(SHINGLE_LENGTH, len(content)):
+        h = (h - ord(content[i - SHINGLE_LENGTH]) * top) % HASH_MOD
+        h = (h * HASH_BASE + ord(content[i])) % HASH_MOD
+        hashes.add(h)
+    return frozenset(heapq.nsmallest(SKETCH_SIZE, hashes))
+
+
+class SpamDetector:
+    """Per-user and per-channel rate limits plus near-duplicate detection.
+
+    Every check does a constant amount of work per message (apart from hashing
+    the message itself, which is bounded by Discord's message length limit).
+    Idle users and channels are evicted by the TTL caches.
+    """
+
+    def __init__(
+        self,
+        user_burst: float = 5,
+        user_rate: float = 1.0,
+        channel_burst: float = 20,
+        channel_rate: float = 5.0,
+        duplicate_count: int = 3,
+        duplicate_window: float = 30,
+        duplicate_similarity: float = 0.7,
+        maxsize: int = 10000,
+    ):
+        self.user_burst = user_burst
+        self.user_rate = user_rate
+        self.channel_burst = channel_burst
+        self.channel_rate = channel_rate
+        self.duplicate_count = duplicate_count
+        self.duplicate_window = duplicate_window
+        self.duplicate_similarity = duplicate_similarity
+        # buckets refill completely after capacity / rate seconds, so they can be dropped then
+        self.user_buckets = TTLCache(maxsize=maxsize, ttl=user_burst / user_rate)
+        self.channel_buckets = TTLCache(
+            maxsize=maxsize, ttl=channel_burst / channel_rate
+        )
+        self.recent = TTLCache(maxsize=maxsize, ttl=duplicate_window)
+
+    def check_user(self, user_id: int, content: str, now: float) -> str:
+        """Return a reason if this message from the user is spam, otherwise None."""
+        bucket = self.user_buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_burst, now)
+        allowed = bucket.take(self.user_burst, self.user_rate, now)
+        self.user_buckets[user_id] = bucket
+        if not allowed:
+            return "sending messages too quickly"
+
+        current = sketch(content)
+        if current is None:
+            return None
+        recent = self.recent.get(user_id)
+        if recent is None:
+            recent = collections.deque(maxlen=self.duplicate_count)
+        duplicates = 1
+        for sent, previous in recent:
+            if now - sent > self.duplicate_window:
+                continue
+            # bottom-k estimate of the jaccard similarity of the two messages' shingles
+            union = heapq.nsmallest(SKETCH_SIZE, current | previous)
+            shared = sum(1 for h in union if h in current and h in previous)
+            if shared / len(union) >= self.duplicate_similarity:
+                duplicates += 1
+        recent.append((now, current))
+        self.recent[user_id] = recent
+        if duplicates >= self.duplicate_count:
+            return "sending duplicate messages"
+        return None
+
+    def check_channel(self, channel_id: int, now: float) -> bool:
+        """Return True if the channel is over its message rate."""
+        bucket = self.channel_buckets.get(channel_id)
+        if bucket is None:
+            bucket = TokenBucket(self.channel_burst, now)
+        allowed = bucket.take(self.channel_burst, self.channel_rate, now)
+        self.channel_buckets[channel_id] = bucket
+        return not allowed
+
+
+class Automod(commands.Cog):
+    def __init__(self, bot, conn, bot_config, logger):
+        self.bot = bot
+        self.conn = conn
+        self.bot_config = bot_config
+        self.logger = logger
+        # every key is optional, configs from before automod existed have no [automod] section
+        config = self.bot_config.get("automod", {})
+        self.detector = SpamDetector(
+            user_burst=config.get("user_burst", 5),
+            user_rate=config.get("user_rate", 1.0),
+            channel_burst=config.get("channel_burst", 20),
+            channel_rate=config.get("channel_rate", 5.0),
+            duplicate_count=config.get("duplicate_count", 3),
+            duplicate_window=config.get("duplicate_window", 30),
+            duplicate_similarity=config.get("duplicate_similarity", 0.7),
+        )
+        self.mute_duration = get_timedelta_from_string(
+            config.get("mute_duration", "10m")
+        )
+        self.channel_slowmode = config.get("channel_slowmode", 5)
+        # don't act on the same user or channel twice while the first action is in flight
+        self.actioned_users = TTLCache(maxsize=1000, ttl=60)
+        self.actioned_channels = TTLCache(maxsize=1000, ttl=300)
+        self.logger.log(logging.INFO, "Loaded automod cog")
+        print("Loaded automod cog")
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        if message.author.bot:
+            return True
+        if not message.guild:
+            return True
+        if message.guild.id != self.bot_config["guild"]["guild_id"]:
+            return True
+        if message.channel.permissions_for(message.author).manage_messages:
+            return True
+        now = time.monotonic()
+        if self.detector.check_channel(message.channel.id, now):
+            await self.slow_channel(message.channel)
+        reason = self.detector.check_user(message.author.id, message.content, now)
+        if reason:
+            await self.mute_spammer(message.author, reason)
+
+    async def mute_spammer(self, member: discord.Member, reason: str):
+        if member.id in self.actioned_users:
+            return
+        self.actioned_users[member.id] = True
+        mute_role = member.guild.get_role(self.bot_config["moderation"]["mute_role"])
+        if mute_role in member.roles:
+            return
+        moderation = self.bot.get_cog("Moderation")
+        if not moderation:
+            self.logger.log(
+                logging.WARN, "Automod: moderation cog is not loaded, can't mute"
+            )
+            return
+        self.logger.log(
+            logging.INFO, f"Automod: muting {member} ({member.id}) for {reason}"
+        )
+        await moderation.mute_member(
+            member,
+            member.guild.me,
+            self.mute_duration,
+            f"Automod: {reason}",
+        )
+
+    async def slow_channel(self, channel: discord.TextChannel):
+        if channel.id in self.actioned_channels:
+            return
+        self.actioned_channels[channel.id] = True
+        if channel.slowmode_delay >= self.channel_slowmode:
+            return
+        self.logger.log(
+            logging.INFO,
+            f"Automod: setting slowmode in #{channel.name} ({channel.id}) to {self.channel_slowmode} seconds",
+        )
+        await channel.edit(
+            slowmode_delay=self.channel_slowmode, reason="Automod: channel flood"
+        )
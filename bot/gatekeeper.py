@@ -22,6 +22,8 @@ from datetime import datetime
 import discord
 from discord.ext import commands
 
+from bot.job_queue import PRIORITY_LOW, PRIORITY_NORMAL, JobQueue
+
 
 class SimpleGatekeeper(commands.Cog):
     def __init__(self, bot, conn, config, logger):
@@ -29,9 +31,16 @@ class SimpleGatekeeper(commands.Cog):
         self.conn = conn
         self.bot_config = config
         self.logger = logger
+        # joins are processed a few at a time, so a raid doesn't exhaust the rate limits
+        self.join_queue = JobQueue(
+            "Join", self.bot_config["gatekeeper"].get("join_workers", 2), self.logger
+        )
         self.logger.log(logging.INFO, "Loaded simple gatekeeper cog")
         print("Loaded simple gatekeeper cog")
 
+    def cog_unload(self):
+        self.join_queue.stop()
+
     @commands.Cog.listener()
     async def on_member_join(self, member):
         if member.guild.id == self.bot_config["guild"]["guild_id"]:
@@ -39,13 +48,38 @@ class SimpleGatekeeper(commands.Cog):
                 logging.INFO,
                 f"A new member joined {member.guild.name}: {member.name}#{member.discriminator} ({member.id})",
             )
-            await member.add_roles(
-                member.guild.get_role(self.bot_config["gatekeeper"]["gatekeeper_role"]),
-                reason="Interview: add gatekeeper role",
-            )
-            await self.send_gatekeeper_message(member)
+            if self.join_queue.backlog() >= self.bot_config["gatekeeper"].get(
+                "join_backlog_limit", 10
+            ):
+                # join burst: only add the role now, the message is sent once the
+                # joins queued before the burst are done
+                await self.add_gatekeeper_role(member)
+                self.join_queue.submit(
+                    member.id,
+                    lambda: self.send_gatekeeper_message(member),
+                    PRIORITY_LOW,
+                )
+            else:
+                self.join_queue.submit(
+                    member.id, lambda: self.process_join(member), PRIORITY_NORMAL
+                )
+
+    async def add_gatekeeper_role(self, member: discord.Member):
+        await member.add_roles(
+            member.guild.get_role(self.bot_config["gatekeeper"]["gatekeeper_role"]),
+            reason="Interview: add gatekeeper role",
+        )
+
+    async def process_join(self, member: discord.Member):
+        if not member.guild.get_member(member.id):
+            # left (or was banned) while waiting in the queue
+            return
+        await self.add_gatekeeper_role(member)
+        await self.send_gatekeeper_message(member)
 
     async def send_gatekeeper_message(self, member: discord.Member):
+        if not member.guild.get_member(member.id):
+            return
         gatekeeper_channel = member.guild.get_channel(
             self.bot_config["gatekeeper"]["simple"]["gatekeeper_channel"]
         )
@@ -144,14 +144,18 @@ class HelpCommand(commands.Cog):
                 colour=discord.Colour(0x4A90E2), title="Moderation commands"
             )
             embed4.description = (
+                "`dossier <user: User>`: show a summary of a user's logs, notes, active mute and tickets\n"
                 "`hardmute <user: Member> <duration: Duration> [reason: str]`: hardmute a user for the specified duration\n"
                 "`lockdown [channel: TextChannel]`: lock a channel, so no users can send messages in the channel\n"
+                "`lockdown all` / `lockdown category <category: CategoryChannel>`: lock every channel in the server or a category\n"
                 "`massban <users: ...User> [reason: str]`: mass ban users, with an optional reason\n"
                 "`modlogs <user: User> [page: int]`: show the moderation logs for a user\n"
                 "`mute <user: Member> <duration: Duration> [reason: str]`: mute a user for the specified duration\n"
+                "`purge <count: int> [user:<user>] [regex:<pattern>] [links] [bots] [after:<duration>] [before:<duration>]`: bulk delete messages matching all given filters\n"
                 "`slowmode <delay: int> [channel: TextChannel]`: set the slowmode for a channel\n"
                 "`unban <user: User> [reason: str]`: unban the specified user, with an optional reason\n"
                 "`unlockdown [channel: TextChannel]`: unlock a channel\n"
+                "`unlockdown all` / `unlockdown category <category: CategoryChannel>`: restore channels locked with `lockdown all`/`category`\n"
                 "`unmute <user: Member> [reason: str]`: unmute a user, with an optional reason\n"
                 "`warn <user: Member> <reason: str>`: warn a user"
             )
@@ -174,7 +178,10 @@ class HelpCommand(commands.Cog):
             embed5.description = (
                 "**These commands require `Manage Server` to use.\n\n**"
                 "`interview approve`: approve a user\n"
-                "`interview deny`: deny a user"
+                "`interview deny`: deny a user\n"
+                "`interview questions`: list the interview questions\n"
+                "`interview questions add <question: str>`: add a question after the others\n"
+                "`interview questions remove <id: int>`: remove a question"
             )
             embed5.set_footer(text=common_footer)
             help_embeds.append(embed5)
@@ -188,6 +195,16 @@ class HelpCommand(commands.Cog):
             )
             embed6.set_footer(text=common_footer)
             help_embeds.append(embed6)
+        if self.bot_config["cogs"].get("enable_filter", False):
+            embed7 = discord.Embed(colour=discord.Colour(0x4A90E2), title="Filter")
+            embed7.description = (
+                "**These commands require `Manage Server` to use.\n\n**"
+                "`filter [page: int]`: list the current filter rules\n"
+                "`filter add <type: word|wildcard|invite> <action: delete|warn|mute> <pattern: str>`: add a filter rule, wildcard rules use `*` for any letters and invite rules take an invite code or `*` for all invites\n"
+                "`filter remove <id: int>`: remove a filter rule"
+            )
+            embed7.set_footer(text=common_footer)
+            help_embeds.append(embed7)
 
         for index, embed in enumerate(help_embeds, start=1):
             embed.title = embed.title + f" (page {index}/{len(help_embeds)})"
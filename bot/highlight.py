@@ -149,7 +149,7 @@ class Highlights(commands.Cog):
         current_highlights = await self.conn.get_highlights_for_user(ctx.author.id)
         matched = None
         for highlight in current_highlights:
-            if word == highlight["word"]:
+            if word == highlight.word:
                 matched = word
         if matched:
             await self.conn.remove_highlight(ctx.author.id, word)
@@ -17,14 +17,110 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
+import gzip
 import io
+import json
 import logging
+import tempfile
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import aiohttp
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
+
+from bot.attachments import ArchiveStats, AttachmentArchiver, archive_attachments
+from bot.job_queue import PRIORITY_LOW, PRIORITY_NORMAL, JobQueue
+from database import rows
+
+# discord's limits for a single (webhook) message
+MESSAGE_MAX_LENGTH = 2000
+MESSAGE_MAX_EMBEDS = 10
+# the largest file a webhook can upload to a guild without boosts
+UPLOAD_MAX_SIZE = 8 * 1024 * 1024
+
+# channels are archived after counting down these steps, one per DELETION_STEP
+DELETION_COUNTDOWN = (
+    "five minutes",
+    "four minutes",
+    "three minutes",
+    "two minutes",
+    "one minute",
+)
+DELETION_STEP = timedelta(minutes=1)
+# if the bot stops before an archive finishes, it's retried after this long
+ARCHIVE_RETRY = timedelta(minutes=30)
+
+
+class WebhookPost:
+    """One or more consecutive messages by the same author, replayed as one webhook message."""
+
+    __slots__ = ("author", "content", "embeds", "count")
+
+    def __init__(self, author, content: str, embeds: list):
+        self.author = author
+        self.content = content
+        self.embeds = list(embeds)
+        self.count = 1
+
+    def add(self, content: str, embeds: list) -> bool:
+        """Add a message to this post if it fits, returning whether it did."""
+        joined = (
+            f"{self.content}\n{content}"
+            if self.content and content
+            else (self.content or content)
+        )
+        if (
+            len(joined) > MESSAGE_MAX_LENGTH
+            or len(self.embeds) + len(embeds) > MESSAGE_MAX_EMBEDS
+        ):
+            return False
+        self.content = joined
+        self.embeds.extend(embeds)
+        self.count += 1
+        return True
+
+
+def transcript_line(message: discord.Message, hashes: dict) -> bytes:
+    return (
+        json.dumps(
+            {
+                "id": message.id,
+                "timestamp": message.created_at.isoformat(),
+                "author": {
+                    "id": message.author.id,
+                    "username": message.author.name,
+                    "discriminator": message.author.discriminator,
+                    "bot": message.author.bot,
+                },
+                "content": message.content,
+                "embeds": [embed.to_dict() for embed in message.embeds],
+                "attachments": [
+                    {
+                        "filename": attachment.filename,
+                        "url": attachment.url,
+                        # where the file is in the attachment store, if it was archived
+                        "sha256": hashes.get(attachment.id),
+                    }
+                    for attachment in message.attachments
+                ],
+            }
+        ).encode()
+        + b"\n"
+    )
+
+
+def pack_messages(messages: list) -> list:
+    posts = []
+    for message in messages:
+        content = message.clean_content[:MESSAGE_MAX_LENGTH]
+        if not (
+            posts
+            and posts[-1].author.id == message.author.id
+            and posts[-1].add(content, message.embeds)
+        ):
+            posts.append(WebhookPost(message.author, content, message.embeds))
+    return posts
 
 
 class Interviews(commands.Cog):
@@ -33,9 +129,72 @@ class Interviews(commands.Cog):
         self.conn = conn
         self.bot_config = config
         self.logger = logger
-        self.archive_in_progress = False
+        # open interviews by channel id, so events in other channels don't need a query
+        self.interviews = {}
+        # the questions in the order they're asked, replaced as a whole when they change
+        self.question_list = ()
+        self.attachment_archiver = AttachmentArchiver.from_config(
+            self.bot_config, self.logger
+        )
+        # one session and webhook for all archives, rather than a new connection per message
+        self.session = aiohttp.ClientSession()
+        self.log_webhook = discord.Webhook.from_url(
+            self.bot_config["gatekeeper"]["advanced"]["log_webhook"],
+            adapter=discord.AsyncWebhookAdapter(self.session),
+        )
+        # archiving posts every message to the same webhook, so more workers mostly
+        # means more rate limiting; one is enough for normal use
+        self.archive_queue = JobQueue(
+            "Archive",
+            self.bot_config["gatekeeper"]["advanced"].get("archive_workers", 1),
+            self.logger,
+        )
+        # joins are processed a few at a time, so a raid doesn't exhaust the rate limits
+        self.join_queue = JobQueue(
+            "Join", self.bot_config["gatekeeper"].get("join_workers", 2), self.logger
+        )
         self.logger.log(logging.INFO, "Loaded interviews cog")
         print("Loaded interviews cog")
+        self.bot.loop.create_task(self.load_interviews())
+        self.bot.loop.create_task(self.setup_questions())
+        self.run_delayed_jobs.start()
+
+    def cog_unload(self):
+        self.run_delayed_jobs.cancel()
+        self.join_queue.stop()
+        self.archive_queue.stop()
+        self.bot.loop.create_task(self.session.close())
+        if self.attachment_archiver:
+            self.bot.loop.create_task(self.attachment_archiver.close())
+
+    async def load_interviews(self):
+        self.interviews = {
+            interview.channel_id: interview
+            for interview in await self.conn.get_all_interviews()
+        }
+        self.logger.log(logging.INFO, f"Loaded {len(self.interviews)} interviews")
+
+    async def setup_questions(self):
+        # questions used to be set in the config, so the first start copies those over
+        questions = [
+            str(question)
+            for question in self.bot_config["gatekeeper"]["advanced"].get(
+                "interview_questions", []
+            )
+            if question
+        ]
+        if await self.conn.seed_interview_questions(questions):
+            self.logger.log(
+                logging.INFO,
+                f"Copied {len(questions)} interview questions from the config",
+            )
+        await self.load_questions()
+
+    async def load_questions(self):
+        self.question_list = tuple(await self.conn.get_interview_questions())
+        self.logger.log(
+            logging.INFO, f"Loaded {len(self.question_list)} interview questions"
+        )
 
     @commands.Cog.listener()
     async def on_command_error(self, ctx, error):
@@ -67,12 +226,40 @@ class Interviews(commands.Cog):
                 logging.INFO,
                 f"A new member joined {member.guild.name}: {member.name}#{member.discriminator} ({member.id})",
             )
-            await member.add_roles(
-                member.guild.get_role(self.bot_config["gatekeeper"]["gatekeeper_role"]),
-                reason="Interview: add gatekeeper role",
-            )
-            if not await self.conn.get_interview(member.id):
-                await self.create_interview_channel(member, member.guild)
+            if self.join_queue.backlog() >= self.bot_config["gatekeeper"].get(
+                "join_backlog_limit", 10
+            ):
+                # join burst: only add the role now, the channel is created once the
+                # joins queued before the burst are done
+                await self.add_gatekeeper_role(member)
+                self.join_queue.submit(
+                    member.id,
+                    lambda: self.create_join_interview(member),
+                    PRIORITY_LOW,
+                )
+            else:
+                self.join_queue.submit(
+                    member.id, lambda: self.process_join(member), PRIORITY_NORMAL
+                )
+
+    async def add_gatekeeper_role(self, member: discord.Member):
+        await member.add_roles(
+            member.guild.get_role(self.bot_config["gatekeeper"]["gatekeeper_role"]),
+            reason="Interview: add gatekeeper role",
+        )
+
+    async def process_join(self, member: discord.Member):
+        if not member.guild.get_member(member.id):
+            # left (or was banned) while waiting in the queue
+            return
+        await self.add_gatekeeper_role(member)
+        await self.create_join_interview(member)
+
+    async def create_join_interview(self, member: discord.Member):
+        if not member.guild.get_member(member.id):
+            return
+        if not await self.conn.get_interview(member.id):
+            await self.create_interview_channel(member, member.guild)
 
     @commands.Cog.listener()
     async def on_member_remove(self, member):
@@ -92,7 +279,7 @@ class Interviews(commands.Cog):
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload):
-        interview = await self.conn.get_interview_from_channel(payload.channel_id)
+        interview = self.interviews.get(payload.channel_id)
         if interview:
             if (
                 payload.user_id == interview[0]
@@ -108,14 +295,18 @@ class Interviews(commands.Cog):
                 await message.remove_reaction("👍", payload.member)
 
     async def send_next_question(self, interview, channel: discord.TextChannel):
-        questions = self.bot_config["gatekeeper"]["advanced"]["interview_questions"]
+        questions = self.question_list
         if interview[2] < len(questions):
             self.logger.log(
                 logging.INFO,
                 f"Sent question {interview[2]} to #{channel.name} ({channel.id})",
             )
-            await channel.send(questions[interview[2]])
-            await self.conn.increment_question(interview[2] + 1, channel.id)
+            await channel.send(questions[interview[2]].question)
+            await self.conn.queue_increment_question(interview[2] + 1, channel.id)
+            if channel.id in self.interviews:
+                self.interviews[channel.id] = interview._replace(
+                    current_question=interview[2] + 1
+                )
 
     async def send_welcome_message(
         self, member: discord.Member, channel: discord.TextChannel
@@ -177,6 +368,9 @@ class Interviews(commands.Cog):
         )
         welcome_message = await self.send_welcome_message(member, channel)
         await self.conn.create_interview(member.id, channel.id, welcome_message.id)
+        self.interviews[channel.id] = rows.Interview(
+            member.id, channel.id, 0, welcome_message.id
+        )
         return channel
 
     @commands.group(aliases=["in"], help="Interview commands")
@@ -241,6 +435,53 @@ class Interviews(commands.Cog):
             await self.queue_channel_deletion(ctx.message.channel, member, True)
             await asyncio.sleep(150)
 
+    @interview.group(
+        name="questions",
+        help="List the interview questions.",
+        invoke_without_command=True,
+    )
+    async def questions(self, ctx):
+        embed = discord.Embed(
+            title="Interview questions",
+            colour=discord.Colour(0x7ED321),
+            timestamp=datetime.utcnow(),
+        )
+        if self.question_list:
+            embed.description = ""
+            for i, question in enumerate(self.question_list, 1):
+                text = question.question
+                if len(text) > 100:
+                    text = text[:99] + "…"
+                line = f"{i}. {text} (**#{question.id}**)\n"
+                if len(embed.description) + len(line) > 2000:
+                    embed.description += "…"
+                    break
+                embed.description += line
+        else:
+            embed.description = f"There are no interview questions. Add one with `{ctx.prefix}interview questions add`."
+        embed.set_footer(text=f"{len(self.question_list)} questions")
+        await ctx.send(embed=embed)
+
+    @questions.command(name="add", help="Add an interview question after the others.")
+    async def questions_add(self, ctx, *, question: str):
+        if len(question) > 2000:
+            await ctx.send("Questions can be at most 2000 characters.")
+            return True
+        question_id = await self.conn.add_interview_question(question)
+        await self.load_questions()
+        await ctx.send(
+            f"✅ Added question #{question_id}, it's question {len(self.question_list)} of the interview."
+        )
+
+    @questions.command(name="remove", help="Remove an interview question.")
+    async def questions_remove(self, ctx, question_id: int):
+        question = await self.conn.remove_interview_question(question_id)
+        if not question:
+            await ctx.send(f"There is no interview question #{question_id}.")
+            return True
+        await self.load_questions()
+        await ctx.send(f"✅ Removed question #{question_id}.")
+
     @interview.command(
         name="manual-archive",
         help="Manually archive the channel, in case a user was let in without going through CoveBot.",
@@ -258,69 +499,216 @@ class Interviews(commands.Cog):
             logging.INFO,
             f"Deleting channel #{channel.name} ({channel.id}) in five minutes",
         )
-        archive_message = await channel.send("Archiving channel in five minutes.")
+        archive_message = await channel.send(
+            f"Archiving channel in {DELETION_COUNTDOWN[0]}."
+        )
         await self.conn.delete_interview_entry(channel.id)
-        await asyncio.sleep(60)
-        await archive_message.edit(content="Archiving channel in four minutes.")
-        if kick:
-            await member.send(
-                f"We're really sorry, {member.mention}, but we do not think you are a good fit for {member.guild.name} at this time.\nYou were automatically kicked."
+        self.interviews.pop(channel.id, None)
+        # the rest of the countdown is stored, so it picks up where it left off after a restart
+        await self.conn.add_delayed_job(
+            "kick_and_archive" if kick else "archive",
+            channel.id,
+            member.id,
+            archive_message.id,
+            datetime.utcnow() + DELETION_STEP,
+        )
+
+    @tasks.loop(seconds=10.0)
+    async def run_delayed_jobs(self):
+        # an unhandled exception would stop the loop for good, so log it and try again next time
+        try:
+            jobs = await self.conn.get_due_delayed_jobs()
+            if jobs:
+                await asyncio.gather(*(self.try_delayed_job(job) for job in jobs))
+        except Exception:
+            self.logger.exception("Running delayed jobs failed")
+
+    async def try_delayed_job(self, job):
+        try:
+            await self.run_delayed_job(job)
+        except Exception:
+            self.logger.exception(
+                f"Delayed job #{job.id} ({job.type}) for channel {job.channel_id} failed"
+            )
+
+    async def run_delayed_job(self, job):
+        guild = self.bot.get_guild(self.bot_config["guild"]["guild_id"])
+        channel = guild.get_channel(job.channel_id)
+        if channel is None:
+            # deleted by hand, or archived just before a restart
+            await self.conn.delete_delayed_jobs(job.channel_id)
+            return
+        step = job.step + 1
+        # advance before acting, so a failure or restart never kicks someone twice.
+        # steps are scheduled from the previous run_at, so a countdown that was
+        # interrupted by a restart catches up instead of starting over
+        if step < len(DELETION_COUNTDOWN):
+            await self.conn.advance_delayed_job(
+                job.id, step, job.run_at + DELETION_STEP
             )
-            await asyncio.sleep(5)
-            await member.kick(reason="Interview: automatic kick after being denied.")
-        await asyncio.sleep(60)
-        await archive_message.edit(content="Archiving channel in three minutes.")
-        await asyncio.sleep(60)
-        await archive_message.edit(content="Archiving channel in two minutes.")
-        await asyncio.sleep(60)
-        await archive_message.edit(content="Archiving channel in one minute.")
-        await asyncio.sleep(60)
-        await archive_message.delete()
-        await self.archive_channel(member, channel)
+        else:
+            await self.conn.advance_delayed_job(
+                job.id, step, datetime.utcnow() + ARCHIVE_RETRY
+            )
+        try:
+            archive_message = await channel.fetch_message(job.message_id)
+        except discord.NotFound:
+            archive_message = None
+        member = guild.get_member(job.user_id)
+        if step < len(DELETION_COUNTDOWN):
+            if archive_message:
+                await archive_message.edit(
+                    content=f"Archiving channel in {DELETION_COUNTDOWN[step]}."
+                )
+            if step == 1 and job.type == "kick_and_archive" and member:
+                await member.send(
+                    f"We're really sorry, {member.mention}, but we do not think you are a good fit for {member.guild.name} at this time.\nYou were automatically kicked."
+                )
+                await asyncio.sleep(5)
+                await member.kick(
+                    reason="Interview: automatic kick after being denied."
+                )
+            return
+        if archive_message:
+            await archive_message.delete()
+        # the archive only needs a name and avatar, which users who left still have
+        await self.archive_channel(
+            member or await self.bot.fetch_user(job.user_id), channel
+        )
 
     async def archive_channel(
         self, member: discord.Member, channel: discord.TextChannel
     ):
-        while self.archive_in_progress:
-            pass
-        self.archive_in_progress = True
-        await channel.send("Archiving channel!")
+        ahead = self.archive_queue.submit(
+            channel.id, lambda: self.archive_channel_now(member, channel)
+        )
+        if ahead is None:
+            await channel.send("This channel is already being archived.")
+        elif ahead or self.archive_queue.busy():
+            self.logger.log(
+                logging.INFO,
+                f"Queued #{channel.name} ({channel.id}) for archiving, {ahead} ahead in the queue",
+            )
+            if ahead:
+                await channel.send(
+                    f"Queued for archiving, {ahead} other channels are waiting ahead of this one."
+                )
+            else:
+                await channel.send(
+                    "Queued for archiving, waiting for another archive to finish."
+                )
+
+    async def archive_channel_now(
+        self, member: discord.Member, channel: discord.TextChannel
+    ):
+        status = await channel.send("Archiving channel!")
         await asyncio.sleep(5)
-        messages = await channel.history(limit=200, oldest_first=True).flatten()
-        await self.send_initial_webhook_message(member)
-        await asyncio.sleep(1)
-        for message in messages[1:]:
-            await self.send_webhook_message(message)
-        self.logger.log(logging.INFO, f"Deleting #{channel.name} ({channel.id})")
+        if (
+            self.bot_config["gatekeeper"]["advanced"].get("archive_mode", "replay")
+            == "transcript"
+        ):
+            if not await self.upload_transcript(member, channel, status):
+                # retrying won't make it any smaller, so leave it to the moderators
+                await self.conn.delete_delayed_jobs(channel.id)
+                return
+        else:
+            await self.replay_channel(member, channel, status)
         await channel.delete(reason="Interview: automatic deletion")
-        self.archive_in_progress = False
+        await self.conn.delete_delayed_jobs(channel.id)
 
-    async def send_initial_webhook_message(self, member: discord.Member):
-        async with aiohttp.ClientSession() as session:
-            webhook = discord.Webhook.from_url(
-                self.bot_config["gatekeeper"]["advanced"]["log_webhook"],
-                adapter=discord.AsyncWebhookAdapter(session),
+    async def upload_transcript(
+        self,
+        member: discord.Member,
+        channel: discord.TextChannel,
+        status: discord.Message,
+    ) -> bool:
+        stats = ArchiveStats()
+        with tempfile.TemporaryFile() as transcript:
+            count = 0
+            with gzip.GzipFile(fileobj=transcript, mode="wb") as compressed:
+                # history fetches a page of 100 messages at a time, and every message is
+                # written out as soon as it arrives, so memory use doesn't grow with length
+                async for message, hashes in archive_attachments(
+                    self.attachment_archiver,
+                    channel.history(limit=None, oldest_first=True),
+                    stats,
+                ):
+                    if message.id != status.id:
+                        compressed.write(transcript_line(message, hashes))
+                        count += 1
+            size = transcript.tell()
+            if size > UPLOAD_MAX_SIZE:
+                self.logger.log(
+                    logging.ERROR,
+                    f"Transcript of #{channel.name} ({channel.id}) is {size} bytes, too large to upload",
+                )
+                await status.edit(
+                    content="The transcript is too large to upload, so this channel was not deleted."
+                )
+                return False
+            transcript.seek(0)
+            await self.send_initial_webhook_message(
+                member,
+                file=discord.File(
+                    transcript, filename=f"{channel.name}-{channel.id}.jsonl.gz"
+                ),
             )
-            embed = discord.Embed(title=f"Interview with {member.display_name}")
-            embed.set_thumbnail(url=str(member.avatar_url))
-            embed.set_footer(text=f"User ID: {member.id}")
-            await webhook.send(
-                content="```\n" + ("=" * 30) + "\n```",
-                embed=embed,
-                username=self.bot.user.display_name,
-                avatar_url=self.bot.user.avatar_url,
+        self.logger.log(
+            logging.INFO,
+            f"Uploaded a transcript of {count} messages ({size} bytes), deleting #{channel.name} ({channel.id})",
+        )
+        if self.attachment_archiver:
+            self.logger.log(
+                logging.INFO,
+                f"Archived attachments of #{channel.name} ({channel.id}): {stats.summary()}",
             )
+        return True
 
-    async def send_webhook_message(self, message: discord.Message):
-        async with aiohttp.ClientSession() as session:
-            webhook = discord.Webhook.from_url(
-                self.bot_config["gatekeeper"]["advanced"]["log_webhook"],
-                adapter=discord.AsyncWebhookAdapter(session),
-            )
-            await webhook.send(
-                content=message.clean_content,
-                username=message.author.display_name,
-                avatar_url=message.author.avatar_url,
-                embeds=message.embeds,
-            )
-        await asyncio.sleep(1)
+    async def replay_channel(
+        self,
+        member: discord.Member,
+        channel: discord.TextChannel,
+        status: discord.Message,
+    ):
+        messages = await channel.history(limit=200, oldest_first=True).flatten()
+        messages = messages[1:]
+        posts = pack_messages(messages)
+        await self.send_initial_webhook_message(member)
+        # no sleeps needed, the webhook adapter waits whenever the rate limit headers say so
+        archived = 0
+        for i, post in enumerate(posts, 1):
+            await self.send_webhook_post(post)
+            archived += post.count
+            if i % 10 == 0 and i < len(posts):
+                await status.edit(
+                    content=f"Archiving channel! ({archived}/{len(messages)} messages)"
+                )
+        self.logger.log(
+            logging.INFO,
+            f"Archived {len(messages)} messages in {len(posts)} posts, deleting #{channel.name} ({channel.id})",
+        )
+
+    async def send_initial_webhook_message(
+        self, member: discord.Member, file: discord.File = None
+    ):
+        embed = discord.Embed(title=f"Interview with {member.display_name}")
+        embed.set_thumbnail(url=str(member.avatar_url))
+        embed.set_footer(text=f"User ID: {member.id}")
+        await self.log_webhook.send(
+            content="```\n" + ("=" * 30) + "\n```",
+            embed=embed,
+            file=file,
+            username=self.bot.user.display_name,
+            avatar_url=self.bot.user.avatar_url,
+        )
+
+    async def send_webhook_post(self, post: WebhookPost):
+        if not post.content and not post.embeds:
+            # attachment-only messages, which the archive doesn't include
+            return
+        await self.log_webhook.send(
+            content=post.content,
+            username=post.author.display_name,
+            avatar_url=post.author.avatar_url,
+            embeds=post.embeds,
+        )
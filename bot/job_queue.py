@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import itertools
+import logging
+
+# job priorities, lower priorities run first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class JobQueue:
+    """Runs jobs in the background on a fixed number of workers, by priority, then in the order they're submitted.
+
+    Jobs are keyed, and a job whose key is already queued or running isn't
+    queued again. A job is a coroutine function taking no arguments.
+    """
+
+    def __init__(self, name: str, workers: int, logger):
+        self.name = name
+        self.logger = logger
+        self.queue = asyncio.PriorityQueue()
+        self.counter = itertools.count()
+        # queued jobs by key, as ((priority, submission number), job)
+        self.waiting = {}
+        self.running = set()
+        self.workers = [asyncio.ensure_future(self.work()) for _ in range(workers)]
+
+    def submit(self, key, job, priority: int = PRIORITY_NORMAL) -> int:
+        """Queue a job, returning how many jobs are ahead of it, or None if its key is already queued or running."""
+        if key in self.waiting or key in self.running:
+            return None
+        order = (priority, next(self.counter))
+        self.waiting[key] = (order, job)
+        self.queue.put_nowait((order, key))
+        return self.position(key)
+
+    def backlog(self) -> int:
+        return len(self.waiting)
+
+    def busy(self) -> bool:
+        return len(self.running) >= len(self.workers)
+
+    def position(self, key) -> int:
+        """Return how many jobs are ahead of a queued job, 0 if it's running, or None if it's neither."""
+        if key in self.running:
+            return 0
+        if key not in self.waiting:
+            return None
+        order = self.waiting[key][0]
+        return sum(1 for other, _ in self.waiting.values() if other < order)
+
+    async def work(self):
+        while True:
+            _, key = await self.queue.get()
+            _, job = self.waiting.pop(key)
+            self.running.add(key)
+            try:
+                await job()
+            except Exception as e:
+                self.logger.log(logging.WARN, f"{self.name} job {key} failed: {e}")
+            finally:
+                self.running.discard(key)
+
+    def stop(self):
+        for worker in self.workers:
+            worker.cancel()
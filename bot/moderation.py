@@ -16,20 +16,31 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
 import datetime
 import io
 import json
 import logging
 import math
 import re
+import time
 import typing
 
 import discord
 from discord.ext import commands, tasks
 
+from database.unit_of_work import UnitOfWork
+
 time_match = re.compile(
     r"((?P<weeks>\d+)w)?((?P<days>\d+)d)?((?P<hours>\d+)h)?((?P<minutes>\d+)m)?"
 )
+link_match = re.compile(r"https?://\S+", re.I)
+
+# the most messages purge will delete, and the most it will look through to find them
+PURGE_MAX_COUNT = 1000
+PURGE_SCAN_LIMIT = 10000
+# the bulk delete endpoint only accepts messages younger than 14 days
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14, minutes=-1)
 
 
 def none_to_zero(arg):
@@ -76,26 +87,25 @@ class Moderation(commands.Cog):
     @tasks.loop(seconds=30.0)
     async def do_pending_actions(self):
         guild = self.bot.get_guild(self.bot_config["guild"]["guild_id"])
-        actions = await self.conn.get_pending_actions()
+        actions = await self.conn.get_due_pending_actions()
         for action in actions:
-            if action[4] < datetime.datetime.utcnow():
-                member = guild.get_member(action[5])
-                if (
-                    action[1] == "mute"
-                    or action[1] == "hardmute"
-                    or action[1] == "pause"
-                ):
-                    await self.unmute_inner(member, action[2], action[3])
-                    await self.conn.add_to_mod_logs(
+            member = guild.get_member(action[5])
+            if action[1] == "mute" or action[1] == "hardmute" or action[1] == "pause":
+                await self.unmute_inner(member, action[2], action[3])
+                case_id = await self.conn.commit_work(
+                    UnitOfWork()
+                    .add_to_mod_logs(
                         member.id, self.bot.user.id, "unmute", "Automatic unmute"
                     )
-                    await self.make_log_embed(
-                        member,
-                        "unmuted",
-                        guild.get_member(self.bot.user.id),
-                        "Automatic unmute",
-                    )
-                    await self.conn.delete_pending_action(action[0])
+                    .delete_pending_action(action[0])
+                )
+                await self.make_log_embed(
+                    member,
+                    "unmuted",
+                    guild.get_member(self.bot.user.id),
+                    "Automatic unmute",
+                    case_id,
+                )
 
     @commands.command(help="Warn a user.")
     @commands.has_guild_permissions(manage_messages=True)
@@ -104,11 +114,16 @@ class Moderation(commands.Cog):
             await ctx.send("But why? <:meowsob:759071377562009620>")
             return True
         await ctx.trigger_typing()
-        await self.conn.add_to_mod_logs(member.id, ctx.author.id, "warn", reason)
-        await member.send(f"You were warned in {ctx.guild.name}. Reason: {reason}")
-        await self.make_log_embed(member, "warned", ctx.author, reason)
+        await self.warn_member(member, ctx.author, reason)
         await ctx.send(f"Warned **{member}**.")
 
+    async def warn_member(
+        self, member: discord.Member, mod: discord.Member, reason: str
+    ):
+        case_id = await self.conn.add_to_mod_logs(member.id, mod.id, "warn", reason)
+        await member.send(f"You were warned in {member.guild.name}. Reason: {reason}")
+        await self.make_log_embed(member, "warned", mod, reason, case_id)
+
     @commands.command(help="Mute a user for the specified duration.")
     @commands.has_guild_permissions(manage_messages=True)
     async def mute(
@@ -129,23 +144,36 @@ class Moderation(commands.Cog):
         await ctx.trigger_typing()
         if not reason:
             reason = "None"
-        expire_time = datetime.datetime.utcnow() + duration
-        await self.conn.set_pending_action(
-            member.id,
-            "mute",
-            [mute_role.id],
-            None,
-            expire_time,
-        )
-        await member.add_roles(mute_role)
-        await self.conn.add_to_mod_logs(member.id, ctx.author.id, "mute", reason)
+        await self.mute_member(member, ctx.author, duration, reason)
         await ctx.send(
             f"**{ctx.message.author}** muted **{member}** for {duration}. Reason: {reason}"
         )
+
+    async def mute_member(
+        self,
+        member: discord.Member,
+        mod: discord.Member,
+        duration: datetime.timedelta,
+        reason: str = "None",
+    ):
+        mute_role = member.guild.get_role(self.bot_config["moderation"]["mute_role"])
+        expire_time = datetime.datetime.utcnow() + duration
+        case_id = await self.conn.commit_work(
+            UnitOfWork()
+            .set_pending_action(
+                member.id,
+                "mute",
+                [mute_role.id],
+                None,
+                expire_time,
+            )
+            .add_to_mod_logs(member.id, mod.id, "mute", reason)
+        )
+        await member.add_roles(mute_role)
         await member.send(
-            f"You were muted in {ctx.guild.name} for {duration}. Reason: {reason}"
+            f"You were muted in {member.guild.name} for {duration}. Reason: {reason}"
         )
-        await self.make_log_embed(member, "muted", ctx.author, reason)
+        await self.make_log_embed(member, "muted", mod, reason, case_id)
 
     @mute.error
     async def mute_error(self, ctx, error):
@@ -184,22 +212,25 @@ class Moderation(commands.Cog):
             roles_to_add.append(role.id)
         await member.remove_roles(*all_roles, atomic=False)
         expire_time = datetime.datetime.utcnow() + duration
-        await self.conn.set_pending_action(
-            member.id,
-            "hardmute",
-            [mute_role.id],
-            roles_to_add,
-            expire_time,
+        case_id = await self.conn.commit_work(
+            UnitOfWork()
+            .set_pending_action(
+                member.id,
+                "hardmute",
+                [mute_role.id],
+                roles_to_add,
+                expire_time,
+            )
+            .add_to_mod_logs(member.id, ctx.author.id, "hardmute", reason)
         )
         await member.add_roles(mute_role, atomic=False)
-        await self.conn.add_to_mod_logs(member.id, ctx.author.id, "hardmute", reason)
         await ctx.send(
             f"**{ctx.message.author}** hardmuted **{member}** for {duration}. Reason: {reason}"
         )
         await member.send(
             f"You were hardmuted in {ctx.guild.name} for {duration}. Reason: {reason}"
         )
-        await self.make_log_embed(member, "hardmuted", ctx.author, reason)
+        await self.make_log_embed(member, "hardmuted", ctx.author, reason, case_id)
 
     @mute.error
     async def hardmute_error(self, ctx, error):
@@ -229,9 +260,12 @@ class Moderation(commands.Cog):
             reason = "None"
         db_entry = await self.conn.get_mute(member.id)
         await self.unmute_inner(member, db_entry[2], db_entry[3])
-        await self.conn.add_to_mod_logs(member.id, ctx.author.id, "unmute", reason)
-        await self.conn.delete_pending_action(db_entry[0])
-        await self.make_log_embed(member, "unmuted", ctx.author, reason)
+        case_id = await self.conn.commit_work(
+            UnitOfWork()
+            .add_to_mod_logs(member.id, ctx.author.id, "unmute", reason)
+            .delete_pending_action(db_entry[0])
+        )
+        await self.make_log_embed(member, "unmuted", ctx.author, reason, case_id)
         await ctx.send(f"Unmuted **{member}**.")
 
     async def unmute_inner(
@@ -260,6 +294,7 @@ class Moderation(commands.Cog):
         action_type: str,
         mod: discord.Member,
         reason: str = "None",
+        case_id: int = None,
     ):
         guild = self.bot.get_guild(self.bot_config["guild"]["guild_id"])
         log_channel = guild.get_channel(self.bot_config["moderation"]["mod_log"])
@@ -269,33 +304,199 @@ class Moderation(commands.Cog):
             description=f"**{mod}** {action_type} **{member}**.\nReason: **{reason}**",
             timestamp=datetime.datetime.utcnow(),
         )
-        embed.set_footer(text=f"User ID: {member.id} | Moderator ID: {mod.id}")
+        footer = f"User ID: {member.id} | Moderator ID: {mod.id}"
+        if case_id:
+            footer += f" | Case #{case_id}"
+        embed.set_footer(text=footer)
         await log_channel.send(embed=embed)
 
-    @commands.command(help="Lock a channel", aliases=["lock", "ld"])
+    @commands.group(
+        help="Lock a channel", aliases=["lock", "ld"], invoke_without_command=True
+    )
     @commands.has_guild_permissions(manage_guild=True)
     async def lockdown(self, ctx, channel: typing.Optional[discord.TextChannel] = None):
         if not channel:
             channel = ctx.message.channel
         await ctx.trigger_typing()
-        overwrites = channel.overwrites
-        overwrites[ctx.guild.default_role].update(send_messages=False)
-        overwrites[self.bot.user] = discord.PermissionOverwrite(send_messages=True)
-        await channel.edit(overwrites=overwrites)
-        await ctx.send(f"✅ Locked down <#{channel.id}>.")
+        locked, failed = await self.lock_channels(ctx.guild, [channel])
+        if failed:
+            await ctx.send(self.lockdown_summary("Locked down", locked, failed))
+        else:
+            await ctx.send(f"✅ Locked down <#{channel.id}>.")
+
+    @lockdown.command(name="all", help="Lock every channel in the server")
+    async def lockdown_all(self, ctx):
+        await ctx.trigger_typing()
+        channels = self.lockable_channels(ctx.guild.text_channels)
+        locked, failed = await self.lock_channels(ctx.guild, channels)
+        await ctx.send(self.lockdown_summary("Locked down", locked, failed))
 
-    @commands.command(help="Unlock a channel", aliases=["unlock", "uld"])
+    @lockdown.command(name="category", help="Lock every channel in a category")
+    async def lockdown_category(self, ctx, *, category: discord.CategoryChannel):
+        await ctx.trigger_typing()
+        channels = self.lockable_channels(category.text_channels)
+        locked, failed = await self.lock_channels(ctx.guild, channels)
+        await ctx.send(self.lockdown_summary("Locked down", locked, failed))
+
+    @commands.group(
+        help="Unlock a channel", aliases=["unlock", "uld"], invoke_without_command=True
+    )
     @commands.has_guild_permissions(manage_guild=True)
     async def unlockdown(
         self, ctx, channel: typing.Optional[discord.TextChannel] = None
     ):
         if not channel:
             channel = ctx.message.channel
-        overwrites = channel.overwrites
-        overwrites[ctx.guild.default_role].update(send_messages=None)
-        overwrites[self.bot.user] = discord.PermissionOverwrite(send_messages=None)
-        await channel.edit(overwrites=overwrites)
-        await ctx.send(f"✅ Unlocked <#{channel.id}>.")
+        await ctx.trigger_typing()
+        unlocked, failed = await self.unlock_channels(ctx.guild, [channel])
+        if failed:
+            await ctx.send(self.lockdown_summary("Unlocked", unlocked, failed))
+        else:
+            await ctx.send(f"✅ Unlocked <#{channel.id}>.")
+
+    @unlockdown.command(name="all", help="Unlock every locked channel in the server")
+    async def unlockdown_all(self, ctx):
+        await ctx.trigger_typing()
+        unlocked, failed = await self.unlock_channels(
+            ctx.guild, ctx.guild.text_channels, snapshots_only=True
+        )
+        await ctx.send(self.lockdown_summary("Unlocked", unlocked, failed))
+
+    @unlockdown.command(name="category", help="Unlock every channel in a category")
+    async def unlockdown_category(self, ctx, *, category: discord.CategoryChannel):
+        await ctx.trigger_typing()
+        unlocked, failed = await self.unlock_channels(
+            ctx.guild, category.text_channels, snapshots_only=True
+        )
+        await ctx.send(self.lockdown_summary("Unlocked", unlocked, failed))
+
+    def lockable_channels(self, channels: list) -> list:
+        # skip channels @everyone already can't talk in, unlocking them later would be wrong
+        return [
+            channel
+            for channel in channels
+            if channel.overwrites_for(channel.guild.default_role).send_messages
+            is not False
+        ]
+
+    def lockdown_summary(self, action: str, done: list, failed: list) -> str:
+        message = f"✅ {action} {len(done)} channels."
+        if failed:
+            mentions = " ".join(f"<#{channel.id}>" for channel in failed[:20])
+            if len(failed) > 20:
+                mentions += f" and {len(failed) - 20} more"
+            message += f"\n⚠ Failed to edit {len(failed)} channels, check my permissions: {mentions}"
+        return message
+
+    async def lock_channels(self, guild: discord.Guild, channels: list):
+        await self.conn.add_lockdown_snapshots(
+            [
+                (channel.id, self.serialise_overwrites(channel.overwrites))
+                for channel in channels
+            ]
+        )
+
+        def locked_overwrites(channel):
+            overwrites = channel.overwrites
+            everyone = overwrites.get(guild.default_role, discord.PermissionOverwrite())
+            everyone.update(send_messages=False)
+            overwrites[guild.default_role] = everyone
+            overwrites[guild.me] = discord.PermissionOverwrite(send_messages=True)
+            return overwrites
+
+        return await self.edit_channel_overwrites(
+            channels, locked_overwrites, "Lockdown"
+        )
+
+    async def unlock_channels(
+        self, guild: discord.Guild, channels: list, snapshots_only: bool = False
+    ):
+        snapshots = {
+            snapshot[0]: snapshot[1]
+            for snapshot in await self.conn.get_lockdown_snapshots(
+                [channel.id for channel in channels]
+            )
+        }
+        if snapshots_only:
+            channels = [channel for channel in channels if channel.id in snapshots]
+
+        def unlocked_overwrites(channel):
+            if channel.id in snapshots:
+                return self.deserialise_overwrites(guild, snapshots[channel.id])
+            # channel was locked before snapshots existed, reset what lockdown changed
+            overwrites = channel.overwrites
+            everyone = overwrites.get(guild.default_role, discord.PermissionOverwrite())
+            everyone.update(send_messages=None)
+            overwrites[guild.default_role] = everyone
+            overwrites[guild.me] = discord.PermissionOverwrite(send_messages=None)
+            return overwrites
+
+        done, failed = await self.edit_channel_overwrites(
+            channels, unlocked_overwrites, "Unlockdown"
+        )
+        # keep the snapshots of channels that couldn't be restored, so unlocking can be retried
+        restored = [channel.id for channel in done if channel.id in snapshots]
+        if restored:
+            await self.conn.delete_lockdown_snapshots(restored)
+        return done, failed
+
+    async def edit_channel_overwrites(
+        self, channels: list, get_overwrites, reason: str
+    ):
+        # channel edits are rate limited per channel, so they can run in parallel,
+        # but keep the number in flight bounded so we stay under the global limit
+        semaphore = asyncio.Semaphore(
+            self.bot_config["moderation"].get("lockdown_concurrency", 5)
+        )
+
+        async def edit(channel):
+            async with semaphore:
+                await channel.edit(overwrites=get_overwrites(channel), reason=reason)
+
+        results = await asyncio.gather(
+            *[edit(channel) for channel in channels], return_exceptions=True
+        )
+        done = []
+        failed = []
+        for channel, result in zip(channels, results):
+            if isinstance(result, Exception):
+                failed.append(channel)
+                self.logger.log(
+                    logging.WARN,
+                    f"{reason}: failed to edit #{channel.name} ({channel.id}): {result}",
+                )
+            else:
+                done.append(channel)
+        return done, failed
+
+    def serialise_overwrites(self, overwrites: dict) -> list:
+        snapshot = []
+        for target, overwrite in overwrites.items():
+            allow, deny = overwrite.pair()
+            snapshot.append(
+                {
+                    "id": target.id,
+                    "type": "role" if isinstance(target, discord.Role) else "member",
+                    "allow": allow.value,
+                    "deny": deny.value,
+                }
+            )
+        return snapshot
+
+    def deserialise_overwrites(self, guild: discord.Guild, snapshot: list) -> dict:
+        overwrites = {}
+        for entry in snapshot:
+            if entry["type"] == "role":
+                target = guild.get_role(entry["id"])
+                if not target:
+                    # the role was deleted during the lockdown
+                    continue
+            else:
+                target = guild.get_member(entry["id"]) or discord.Object(entry["id"])
+            overwrites[target] = discord.PermissionOverwrite.from_pair(
+                discord.Permissions(entry["allow"]), discord.Permissions(entry["deny"])
+            )
+        return overwrites
 
     @commands.command(help="Set a channel's slowmode")
     @commands.has_guild_permissions(manage_messages=True)
@@ -375,6 +576,147 @@ class Moderation(commands.Cog):
         )
         return embed
 
+    @commands.command(help="Show a summary of a user's logs, notes and tickets.")
+    @commands.has_guild_permissions(manage_messages=True)
+    async def dossier(self, ctx, user: discord.User):
+        await ctx.trigger_typing()
+        dossier = await self.conn.get_dossier(user.id)
+        embed = discord.Embed(
+            title="Dossier",
+            colour=discord.Colour(0x404ADD),
+            timestamp=datetime.datetime.utcnow(),
+        )
+        embed.set_author(name=str(user), icon_url=str(user.avatar_url))
+        embed.set_footer(text=f"User ID: {user.id}")
+
+        if dossier.actions:
+            actions = ""
+            for action in dossier.actions:
+                actions += f"**#{action['id']}** {action['type']} by <@{action['mod_id']}> ({self.json_time(action['created'])}): {action['reason']}\n"
+        else:
+            actions = "No moderation logs."
+        embed.add_field(
+            name=f"Moderation logs ({dossier.action_count})",
+            value=actions[:1024],
+            inline=False,
+        )
+
+        if dossier.notes:
+            notes = ""
+            for note in dossier.notes:
+                notes += f"**#{note['id']}** by <@{note['set_by']}>: {note['reason']}\n"
+        else:
+            notes = "No notes."
+        embed.add_field(
+            name=f"Notes ({dossier.note_count})", value=notes[:1024], inline=False
+        )
+
+        pending = dossier.pending_action
+        if pending:
+            pending_string = f"{pending['type'].title()} until {self.json_time(pending['action_time'])} UTC"
+        else:
+            pending_string = "None"
+        embed.add_field(name="Active action", value=pending_string, inline=True)
+        embed.add_field(
+            name="Open tickets", value=str(dossier.ticket_count), inline=True
+        )
+        await ctx.send(embed=embed)
+
+    @dossier.error
+    async def dossier_error(self, ctx, error):
+        if isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send(
+                f"```{ctx.prefix}dossier <user: User>```\nError: missing required parameter `{error.param.name}`"
+            )
+
+    def json_time(self, timestamp: str) -> str:
+        # timestamps in json_agg output are ISO 8601 strings
+        return timestamp[:19].replace("T", " ")
+
+    @commands.command(
+        help="Bulk delete messages. Filters: user:<user> regex:<pattern> links bots after:<duration> before:<duration>",
+        aliases=["clean"],
+    )
+    @commands.has_guild_permissions(manage_messages=True)
+    async def purge(self, ctx, count: int, *filters: str):
+        usage = f"```{ctx.prefix}purge <count: int> [user:<user>] [regex:<pattern>] [links] [bots] [after:<duration>] [before:<duration>]```"
+        if count < 1 or count > PURGE_MAX_COUNT:
+            await ctx.send(
+                f"{usage}\nError: `count` must be between 1 and {PURGE_MAX_COUNT}."
+            )
+            return True
+        checks = []
+        before = ctx.message
+        after = None
+        now = datetime.datetime.utcnow()
+        for purge_filter in filters:
+            key, _, value = purge_filter.partition(":")
+            key = key.lower()
+            try:
+                if key == "user":
+                    user = await commands.UserConverter().convert(ctx, value)
+                    checks.append(lambda m, user_id=user.id: m.author.id == user_id)
+                elif key == "regex":
+                    pattern = re.compile(value, re.I)
+                    checks.append(lambda m, p=pattern: p.search(m.content))
+                elif key == "links":
+                    checks.append(lambda m: link_match.search(m.content))
+                elif key == "bots":
+                    checks.append(lambda m: m.author.bot)
+                elif key == "after":
+                    after = now - get_timedelta_from_string(value)
+                elif key == "before":
+                    before = now - get_timedelta_from_string(value)
+                else:
+                    await ctx.send(f"{usage}\nError: unknown filter `{key}`.")
+                    return True
+            except (commands.BadArgument, re.error) as e:
+                await ctx.send(f"{usage}\nError: invalid filter `{purge_filter}`: {e}")
+                return True
+
+        await ctx.trigger_typing()
+        start = time.monotonic()
+        bulk_cutoff = now - BULK_DELETE_MAX_AGE
+        scanned = 0
+        deleted = 0
+        batch = []
+        # history is fetched lazily, page by page, so we can stop as soon as we have enough
+        async for message in ctx.channel.history(
+            limit=PURGE_SCAN_LIMIT, before=before, after=after, oldest_first=False
+        ):
+            scanned += 1
+            if not all(check(message) for check in checks):
+                continue
+            if message.created_at > bulk_cutoff:
+                batch.append(message)
+                if len(batch) == 100:
+                    await ctx.channel.delete_messages(batch)
+                    batch = []
+            else:
+                # too old for the bulk endpoint
+                await message.delete()
+            deleted += 1
+            if deleted >= count:
+                break
+        if batch:
+            await ctx.channel.delete_messages(batch)
+
+        elapsed = time.monotonic() - start
+        self.logger.log(
+            logging.INFO,
+            f"Purged {deleted} messages in #{ctx.channel.name} ({ctx.channel.id}), scanned {scanned} in {elapsed:.2f}s",
+        )
+        await ctx.send(
+            f"✅ Deleted {deleted} messages (scanned {scanned}) in {elapsed:.2f}s ({deleted / max(elapsed, 0.001):.1f} messages/s)."
+        )
+
+    @purge.error
+    async def purge_error(self, ctx, error):
+        if isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send(
+                f"```{ctx.prefix}purge <count: int> [filters...]```\nError: missing required parameter `{error.param.name}`"
+            )
+
     @commands.command(help="Mass-ban users with an optional reason.")
     @commands.has_guild_permissions(ban_members=True, manage_guild=True)
     async def massban(self, ctx, users: commands.Greedy[discord.User]):
@@ -418,22 +760,25 @@ class Moderation(commands.Cog):
         if not reason:
             reason = "None"
         expire_time = datetime.datetime.utcnow() + duration
-        await self.conn.set_pending_action(
-            member.id,
-            "pause",
-            [mute_role.id],
-            None,
-            expire_time,
+        case_id = await self.conn.commit_work(
+            UnitOfWork()
+            .set_pending_action(
+                member.id,
+                "pause",
+                [mute_role.id],
+                None,
+                expire_time,
+            )
+            .add_to_mod_logs(member.id, ctx.author.id, "pause", reason)
         )
         await member.add_roles(mute_role)
-        await self.conn.add_to_mod_logs(member.id, ctx.author.id, "pause", reason)
         await ctx.send(
             f"**{ctx.message.author}** paused **{member}** for {duration}. Reason: {reason}"
         )
         await member.send(
             f"You were paused in {ctx.guild.name} for {duration}. Reason: {reason}"
         )
-        await self.make_log_embed(member, "paused", ctx.author, reason)
+        await self.make_log_embed(member, "paused", ctx.author, reason, case_id)
 
     @pause.error
     async def pause_error(self, ctx, error):
@@ -16,16 +16,123 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
 import datetime
-import io
+import functools
+import html
 import json
 import logging
 import math
+import os
 import re
+import tempfile
 import typing
+import weakref
+
 import discord
 from discord.ext import commands
 
+from bot.attachments import ArchiveStats, AttachmentArchiver, archive_attachments
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "tickets")
+# the largest upload (all files together) to a guild without boosts
+UPLOAD_MAX_SIZE = 8 * 1024 * 1024
+
+
+@functools.lru_cache(maxsize=None)
+def load_template(name: str) -> str:
+    with open(os.path.join(TEMPLATE_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def render_template(name: str, **values) -> str:
+    # not str.format, as the templates' css has braces of its own
+    template = load_template(name)
+    for key, value in values.items():
+        template = template.replace("{" + key + "}", html.escape(value))
+    return template
+
+
+def message_json(message: discord.Message, hashes: dict) -> dict:
+    return {
+        "id": message.id,
+        "channel_id": message.channel.id,
+        "content": message.stripped_content,
+        "timestamp": str(message.created_at),
+        "tts": message.tts,
+        "pinned": message.pinned,
+        "mention_everyone": message.mention_everyone,
+        "author": {
+            "id": message.author.id,
+            "username": message.author.name,
+            "avatar": message.author.avatar,
+            "discriminator": message.author.discriminator,
+            "bot": message.author.bot,
+        },
+        "embeds": [
+            {
+                "title": embed.title or None,
+                "description": embed.description or None,
+                "footer": {
+                    "text": embed.footer.text or None,
+                    "icon_url": embed.footer.icon_url or None,
+                },
+            }
+            for embed in message.embeds
+        ],
+        "attachments": [
+            {
+                "id": attachment.id,
+                "url": attachment.url,
+                "proxy_url": attachment.proxy_url,
+                "filename": attachment.filename,
+                # where the file is in the attachment store, if it was archived
+                "sha256": hashes.get(attachment.id),
+            }
+            for attachment in message.attachments
+        ],
+        "type": 0,
+        "flags": 0,
+    }
+
+
+def message_html(message: discord.Message, hashes: dict) -> str:
+    parts = [
+        f'        <div class="message" id="message-{message.id}">\n',
+        f'            <img class="message-avatar" src="{html.escape(str(message.author.avatar_url))}" alt="" width="32" height="32">\n',
+        f'            <span class="message-author">{html.escape(str(message.author))}</span>\n',
+        f'            <span class="message-timestamp">{message.created_at:%Y-%m-%d %H:%M:%S} UTC</span>\n',
+    ]
+    if message.content:
+        content = html.escape(message.clean_content).replace("\n", "<br>")
+        parts.append(f'            <div class="message-content">{content}</div>\n')
+    for embed in message.embeds:
+        parts.append('            <div class="message-embed">')
+        if embed.title:
+            parts.append(f"<strong>{html.escape(str(embed.title))}</strong>")
+        if embed.description:
+            description = html.escape(str(embed.description)).replace("\n", "<br>")
+            parts.append(f"<p>{description}</p>")
+        parts.append("</div>\n")
+    for attachment in message.attachments:
+        digest = hashes.get(attachment.id)
+        stored = f" <code>sha256:{digest}</code>" if digest else ""
+        parts.append(
+            f'            <div class="message-attachment"><a href="{html.escape(attachment.url)}">{html.escape(attachment.filename)}</a>{stored}</div>\n'
+        )
+    parts.append("        </div>\n")
+    return "".join(parts)
+
+
+async def export_messages(
+    channel: discord.TextChannel, archiver: AttachmentArchiver, stats: ArchiveStats
+):
+    """Yield the JSON and HTML for every message in a channel, oldest first."""
+    async for message, hashes in archive_attachments(
+        archiver, channel.history(limit=None, oldest_first=True), stats
+    ):
+        yield message_json(message, hashes), message_html(message, hashes)
+
 
 class Tickets(commands.Cog):
     def __init__(self, bot, conn, ticket_settings, bot_config, logger):
@@ -34,9 +141,93 @@ class Tickets(commands.Cog):
         self.ticket_settings = ticket_settings
         self.bot_config = bot_config
         self.logger = logger
+        # one lock per user opening a ticket, so double clicking can't open two.
+        # locks are dropped as soon as nobody holds or waits for them
+        self.open_locks = weakref.WeakValueDictionary()
+        # the overwrites every ticket starts with, built on first use
+        self.base_overwrites = None
+        self.attachment_archiver = AttachmentArchiver.from_config(
+            self.bot_config, self.logger
+        )
         self.logger.log(logging.INFO, "Loaded tickets cog")
         print("Loaded tickets cog")
 
+    def cog_unload(self):
+        if self.attachment_archiver:
+            self.bot.loop.create_task(self.attachment_archiver.close())
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload):
+        # every reaction in the guild comes through here, so check the in-memory settings before anything else
+        if payload.message_id != self.ticket_settings.listen_message:
+            return
+        if (
+            not payload.member
+            or payload.member.bot
+            or str(payload.emoji) != self.ticket_settings.listen_reaction
+        ):
+            return
+        lock = self.open_locks.setdefault(payload.user_id, asyncio.Lock())
+        async with lock:
+            await self.open_ticket(payload.member)
+        channel = self.bot.get_channel(payload.channel_id)
+        if channel:
+            # so the same reaction can be used to open another ticket later
+            message = await channel.fetch_message(payload.message_id)
+            await message.remove_reaction(payload.emoji, payload.member)
+
+    def ticket_overwrites(self, member: discord.Member) -> dict:
+        if self.base_overwrites is None:
+            guild = member.guild
+            self.base_overwrites = {
+                guild.default_role: discord.PermissionOverwrite(read_messages=False),
+                guild.me: discord.PermissionOverwrite(
+                    read_messages=True, send_messages=True, manage_channels=True
+                ),
+            }
+            for role_id in self.bot_config["guild"]["mod_roles"]:
+                role = guild.get_role(role_id)
+                if role:
+                    self.base_overwrites[role] = discord.PermissionOverwrite(
+                        read_messages=True, send_messages=True
+                    )
+        overwrites = dict(self.base_overwrites)
+        overwrites[member] = discord.PermissionOverwrite(
+            read_messages=True, send_messages=True, attach_files=True
+        )
+        return overwrites
+
+    async def open_ticket(self, member: discord.Member):
+        # configs from before tickets existed have no [tickets] section
+        config = self.bot_config.get("tickets", {})
+        if await self.conn.count_open_tickets(member.id) >= config.get(
+            "max_open_tickets", 1
+        ):
+            try:
+                await member.send(
+                    "You already have an open ticket, please use that one instead."
+                )
+            except discord.Forbidden:
+                pass
+            return
+        channel = await member.guild.create_text_channel(
+            f"ticket-{member.name}",
+            overwrites=self.ticket_overwrites(member),
+            category=member.guild.get_channel(config.get("ticket_category", 0)),
+            reason=f"Tickets: opened by {member} ({member.id})",
+        )
+        await self.conn.add_ticket_channel(channel.id, member.id)
+        self.logger.log(
+            logging.INFO,
+            f"Opened ticket #{channel.name} ({channel.id}) for {member} ({member.id})",
+        )
+        # the default welcome message has an escaped newline
+        await channel.send(
+            self.ticket_settings.welcome_message.replace("\\n", "\n").format(
+                mention=member.mention
+            )
+        )
+
     # management commands
     @commands.group(help="Manage tickets.", aliases=["ticket"])
     async def tickets(self, ctx):
@@ -53,7 +244,7 @@ class Tickets(commands.Cog):
         )
         embed.add_field(
             name="Ticket management commands",
-            value=f"`{ctx.prefix}tickets close`: closes the current ticket.\n`{ctx.prefix}tickets save`: saves a transcript for the current ticket.\n`{ctx.prefix}tickets delete`: deletes the current ticket channel.",
+            value=f"`{ctx.prefix}tickets close`: closes the current ticket.\n`{ctx.prefix}tickets reopen`: reopens the current ticket.\n`{ctx.prefix}tickets save`: saves a transcript for the current ticket.\n`{ctx.prefix}tickets delete`: deletes the current ticket channel.",
             inline=False,
         )
         embed.add_field(
@@ -107,6 +298,36 @@ class Tickets(commands.Cog):
                 )
             )
             return True
+        closing = ctx.invoked_with != "reopen"
+        if ticket.ticket_closed == closing:
+            await ctx.send(
+                embed=discord.Embed(
+                    description=f"This ticket is already {'closed' if closing else 'open'}.",
+                    colour=discord.Colour(15158332),
+                )
+            )
+            return True
+        await self.conn.set_ticket_closed(ctx.channel.id, closing)
+        # the user can still read a closed ticket, but not send anything more in it
+        member = ctx.guild.get_member(ticket.user_id)
+        if member:
+            await ctx.channel.set_permissions(
+                member,
+                read_messages=True,
+                send_messages=not closing,
+                attach_files=not closing,
+                reason=f"Tickets: {'closed' if closing else 'reopened'} by {ctx.author} ({ctx.author.id})",
+            )
+        self.logger.log(
+            logging.INFO,
+            f"{'Closed' if closing else 'Reopened'} ticket #{ctx.channel.name} ({ctx.channel.id}) for user {ticket.user_id}",
+        )
+        await ctx.send(
+            embed=discord.Embed(
+                description=f"{'Closed' if closing else 'Reopened'} this ticket.",
+                colour=discord.Colour(0x2EA7C8),
+            )
+        )
 
     @tickets.command()
     @commands.has_permissions(manage_messages=True)
@@ -157,69 +378,67 @@ class Tickets(commands.Cog):
     async def archive(self, ctx):
         # ticket check goes here
         await ctx.trigger_typing()
-        json_out = {
-            "packVersion": 3,
-            "timestamp": str(datetime.datetime.utcnow()),
-            "messages": [],
-            "channel": {
-                "id": ctx.channel.id,
-                "guild_id": ctx.guild.id,
-                "name": ctx.channel.name,
-                "topic": ctx.channel.topic,
-                "type": 0,
-                "nsfw": ctx.channel.is_nsfw(),
-                "rate_limit_per_user": ctx.channel.slowmode_delay,
-            },
+        ticket = await self.conn.get_ticket(ctx.channel.id)
+        user = self.bot.get_user(ticket.user_id) if ticket else None
+        channel_json = {
+            "id": ctx.channel.id,
+            "guild_id": ctx.guild.id,
+            "name": ctx.channel.name,
+            "topic": ctx.channel.topic,
+            "type": 0,
+            "nsfw": ctx.channel.is_nsfw(),
+            "rate_limit_per_user": ctx.channel.slowmode_delay,
         }
-        history = await ctx.channel.history(limit=100).flatten()
-        for message in history:
-            message_json = {
-                "id": message.id,
-                "channel_id": message.channel.id,
-                "content": message.stripped_content,
-                "timestamp": str(message.created_at),
-                "tts": message.tts,
-                "pinned": message.pinned,
-                "mention_everyone": message.mention_everyone,
-                "author": {
-                    "id": message.author.id,
-                    "username": message.author.name,
-                    "avatar": message.author.avatar,
-                    "discriminator": message.author.discriminator,
-                    "bot": message.author.bot,
-                },
-                "embeds": [],
-                "attachments": [],
-                "type": 0,
-                "flags": 0,
-            }
-            if message.attachments:
-                for attachment in message.attachments:
-                    attachment_json = {
-                        "id": attachment.id,
-                        "url": attachment.url,
-                        "proxy_url": attachment.proxy_url,
-                        "filename": attachment.filename,
-                    }
-                    message_json["attachments"].append(attachment_json)
-            if message.embeds:
-                for embed in message.embeds:
-                    embed_json = {
-                        "title": embed.title,
-                        "description": embed.description,
-                    }
-                    embed_json["footer"] = {
-                        "text": embed.footer.text,
-                        "icon_url": embed.footer.icon_url,
-                    }
-                    message_json["embeds"].append(embed_json)
-            json_out["messages"].append(message_json)
-        export_string = json.dumps(json_out, indent=2)
-        export_file = io.BytesIO(bytes(export_string, "utf-8"))
-        await ctx.send(
-            content="Here you go!",
-            file=discord.File(
-                export_file,
-                filename=f"export-{ctx.channel.name}-{str(datetime.datetime.utcnow())}.json",
-            ),
+        header = render_template(
+            "header.html",
+            guild=ctx.guild.name,
+            channel_name=ctx.channel.name,
+            user_name=str(user) if user else ctx.guild.name,
+            user_avatar_url=str(user.avatar_url if user else ctx.guild.icon_url),
         )
+        with tempfile.TemporaryFile() as json_file, tempfile.TemporaryFile() as html_file:
+            # the export is written out one message at a time, so only the current page
+            # of history is ever held in memory, however long the ticket is
+            json_file.write(
+                f'{{"packVersion": 3, "timestamp": {json.dumps(str(datetime.datetime.utcnow()))}, "channel": {json.dumps(channel_json)}, "messages": ['.encode()
+            )
+            html_file.write(header.encode())
+            count = 0
+            stats = ArchiveStats()
+            async for message_data, message_markup in export_messages(
+                ctx.channel, self.attachment_archiver, stats
+            ):
+                if count:
+                    json_file.write(b", ")
+                json_file.write(json.dumps(message_data).encode())
+                html_file.write(message_markup.encode())
+                count += 1
+            json_file.write(b"]}")
+            html_file.write(render_template("footer.html").encode())
+            size = json_file.tell() + html_file.tell()
+            if size > UPLOAD_MAX_SIZE:
+                self.logger.log(
+                    logging.ERROR,
+                    f"Export of #{ctx.channel.name} ({ctx.channel.id}) is {size} bytes, too large to upload",
+                )
+                await ctx.send(
+                    f"The export of {count} messages is too large to upload ({size // 1024} KiB)."
+                )
+                return
+            json_file.seek(0)
+            html_file.seek(0)
+            filename = f"export-{ctx.channel.name}-{str(datetime.datetime.utcnow())}"
+            content = "Here you go!"
+            if self.attachment_archiver:
+                self.logger.log(
+                    logging.INFO,
+                    f"Archived attachments of #{ctx.channel.name} ({ctx.channel.id}): {stats.summary()}",
+                )
+                content += f"\nArchived {stats.summary()}."
+            await ctx.send(
+                content=content,
+                files=[
+                    discord.File(json_file, filename=f"{filename}.json"),
+                    discord.File(html_file, filename=f"{filename}.html"),
+                ],
+            )
@@ -268,3 +268,39 @@ class UserCommands(commands.Cog):
             activity=discord.Game(name=args),
         )
         await ctx.send("Changed presence")
+
+    @commands.command(name="dbstats", help="Show database query statistics")
+    @commands.is_owner()
+    async def db_stats(self, ctx):
+        queries = sorted(
+            self.conn.stats.queries.items(),
+            key=lambda query: query[1].calls * query[1].execute.percentile(50),
+            reverse=True,
+        )
+        lines = []
+        for name, stats in queries[:15]:
+            lines.append(
+                f"{name}: {stats.calls} calls, {stats.rows.percentile(50):.0f} rows (p50)\n"
+                f"  wait    p50 {stats.acquire.percentile(50):.2f} p95 {stats.acquire.percentile(95):.2f} p99 {stats.acquire.percentile(99):.2f} ms\n"
+                f"  execute p50 {stats.execute.percentile(50):.2f} p95 {stats.execute.percentile(95):.2f} p99 {stats.execute.percentile(99):.2f} ms"
+            )
+        embed = discord.Embed(
+            title="Database statistics",
+            colour=discord.Colour(0xF8E71C),
+            timestamp=datetime.datetime.utcnow(),
+        )
+        if lines:
+            embed.description = "```\n" + "\n".join(lines)[:4000] + "\n```"
+        else:
+            embed.description = "No queries have run yet."
+        cache_lines = []
+        for name, (hits, misses, size) in sorted(self.conn.cache.stats().items()):
+            cache_lines.append(f"{name}: {hits} hits, {misses} misses, {size} entries")
+        if cache_lines:
+            embed.add_field(
+                name="Cache", value="```\n" + "\n".join(cache_lines) + "\n```"
+            )
+        embed.set_footer(
+            text=f"Top {len(lines)} of {len(queries)} queries by total execute time"
+        )
+        await ctx.send(embed=embed)
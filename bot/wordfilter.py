@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import datetime
+import logging
+import math
+import re
+import typing
+
+import discord
+from discord.ext import commands
+
+from bot.moderation import get_timedelta_from_string
+
+word_match = re.compile(r"\w+")
+invite_match = re.compile(
+    r"(?:discord(?:app)?\.com/invite|discord\.gg|discord\.me)/([\w-]+)", re.I
+)
+
+RULE_TYPES = ("word", "wildcard", "invite")
+RULE_ACTIONS = ("delete", "warn", "mute")
+WILDCARD = "*"
+wildcard_pattern_match = re.compile(r"[\w*]+")
+
+
+class SegmentTrie:
+    """A character trie of the literal segments wildcard patterns are anchored on."""
+
+    # key under which a node stores the ids of rules whose segment ends there
+    RULES = ""
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, segment: str, rule_id: int):
+        node = self.root
+        for char in segment:
+            node = node.setdefault(char, {})
+        node.setdefault(self.RULES, set()).add(rule_id)
+
+    def remove(self, segment: str, rule_id: int):
+        path = [self.root]
+        for char in segment:
+            path.append(path[-1][char])
+        path[-1][self.RULES].discard(rule_id)
+        if not path[-1][self.RULES]:
+            del path[-1][self.RULES]
+        # prune branches that no longer lead to any rule
+        for char, parent, node in zip(
+            reversed(segment), reversed(path[:-1]), reversed(path[1:])
+        ):
+            if node:
+                break
+            del parent[char]
+
+    def find(self, word: str, start: int, step: int, candidates: set):
+        # walk the trie along the word from start, collecting every segment that matches
+        node = self.root
+        end = len(word) if step == 1 else -1
+        for i in range(start, end, step):
+            node = node.get(word[i])
+            if node is None:
+                return
+            rule_ids = node.get(self.RULES)
+            if rule_ids:
+                candidates.update(rule_ids)
+
+
+class FilterMatcher:
+    """All filter rules compiled into one matcher.
+
+    The message is split into words once. Literal words are a dict lookup per
+    word, and wildcard patterns are anchored on a literal prefix, suffix or
+    infix kept in character tries, so finding candidate patterns for a word is
+    a walk of a few characters rather than a check of every rule. Invites are
+    looked up by code. Adding or removing a rule only touches that rule's
+    entries.
+    """
+
+    def __init__(self):
+        self.rules = {}
+        self.words = {}
+        self.invites = {}
+        self.wildcards = {}
+        self.prefixes = SegmentTrie()
+        # suffixes are stored reversed, so they can be walked from the end of the word
+        self.suffixes = SegmentTrie()
+        self.infixes = SegmentTrie()
+
+    def add(self, rule_id: int, rule_type: str, pattern: str, action: str):
+        pattern = pattern.lower()
+        self.rules[rule_id] = (rule_type, pattern, action)
+        if rule_type == "word":
+            self.words.setdefault(pattern, set()).add(rule_id)
+        elif rule_type == "invite":
+            self.invites.setdefault(pattern, set()).add(rule_id)
+        elif rule_type == "wildcard":
+            self.wildcards[rule_id] = re.compile(
+                r"\w*".join(re.escape(segment) for segment in pattern.split(WILDCARD))
+            )
+            index, segment = self.anchor(pattern)
+            index.add(segment, rule_id)
+
+    def remove(self, rule_id: int):
+        rule_type, pattern, _ = self.rules.pop(rule_id)
+        if rule_type == "word":
+            self.discard(self.words, pattern, rule_id)
+        elif rule_type == "invite":
+            self.discard(self.invites, pattern, rule_id)
+        elif rule_type == "wildcard":
+            del self.wildcards[rule_id]
+            index, segment = self.anchor(pattern)
+            index.remove(segment, rule_id)
+
+    def match(self, content: str):
+        """Return (rule_id, action) for the first rule (by id) the content matches, or None.
+
+        That's the rule a scan of the rules in id order would stop at.
+        """
+        content = content.lower()
+        matched = set()
+        if self.words or self.wildcards:
+            for word in word_match.findall(content):
+                rule_ids = self.words.get(word)
+                if rule_ids:
+                    matched.update(rule_ids)
+                if self.wildcards:
+                    self.match_wildcards(word, matched)
+        if self.invites:
+            for code in invite_match.findall(content):
+                # rules for this code and for any invite both apply
+                matched.update(self.invites.get(code.lower(), ()))
+                matched.update(self.invites.get(WILDCARD, ()))
+        if not matched:
+            return None
+        rule_id = min(matched)
+        return rule_id, self.rules[rule_id][2]
+
+    def match_wildcards(self, word: str, matched: set):
+        candidates = set()
+        if self.prefixes.root:
+            self.prefixes.find(word, 0, 1, candidates)
+        if self.suffixes.root:
+            self.suffixes.find(word, len(word) - 1, -1, candidates)
+        if self.infixes.root:
+            for i in range(len(word)):
+                self.infixes.find(word, i, 1, candidates)
+        for rule_id in candidates:
+            if self.wildcards[rule_id].fullmatch(word):
+                matched.add(rule_id)
+
+    def anchor(self, pattern: str):
+        # anchor on the longest literal part, since that narrows down candidates the most,
+        # preferring the start or end of the pattern as those are cheaper to look up
+        segments = pattern.split(WILDCARD)
+        longest = max(segments, key=len)
+        if len(segments[0]) == len(longest):
+            return self.prefixes, segments[0]
+        if len(segments[-1]) == len(longest):
+            return self.suffixes, segments[-1][::-1]
+        return self.infixes, longest
+
+    def discard(self, index: dict, pattern: str, rule_id: int):
+        rule_ids = index.get(pattern)
+        if rule_ids:
+            rule_ids.discard(rule_id)
+            if not rule_ids:
+                del index[pattern]
+
+
+class WordFilter(commands.Cog):
+    def __init__(self, bot, conn, bot_config, logger):
+        self.bot = bot
+        self.conn = conn
+        self.bot_config = bot_config
+        self.logger = logger
+        self.matcher = FilterMatcher()
+        self.mute_duration = get_timedelta_from_string(
+            self.bot_config.get("automod", {}).get("filter_mute_duration", "1h")
+        )
+        self.bot.loop.create_task(self.load_rules())
+        self.logger.log(logging.INFO, "Loaded filter cog")
+        print("Loaded filter cog")
+
+    async def load_rules(self):
+        matcher = FilterMatcher()
+        for rule in await self.conn.get_filter_rules():
+            matcher.add(rule[0], rule[1], rule[2], rule[3])
+        self.matcher = matcher
+        self.logger.log(logging.INFO, f"Loaded {len(matcher.rules)} filter rules")
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        if message.author.bot:
+            return True
+        if not message.guild:
+            return True
+        if message.guild.id != self.bot_config["guild"]["guild_id"]:
+            return True
+        result = self.matcher.match(message.content)
+        if not result:
+            return True
+        if message.channel.permissions_for(message.author).manage_messages:
+            return True
+        rule_id, action = result
+        self.logger.log(
+            logging.INFO,
+            f"Filter: message {message.id} by {message.author} ({message.author.id}) matched rule #{rule_id}, action {action}",
+        )
+        await message.delete()
+        if action == "delete":
+            return True
+        moderation = self.bot.get_cog("Moderation")
+        if not moderation:
+            self.logger.log(
+                logging.WARN, f"Filter: moderation cog is not loaded, can't {action}"
+            )
+            return True
+        reason = f"Filter: message matched rule #{rule_id}"
+        if action == "warn":
+            await moderation.warn_member(message.author, message.guild.me, reason)
+        elif action == "mute":
+            mute_role = message.guild.get_role(
+                self.bot_config["moderation"]["mute_role"]
+            )
+            if mute_role not in message.author.roles:
+                await moderation.mute_member(
+                    message.author, message.guild.me, self.mute_duration, reason
+                )
+
+    @commands.group(
+        name="filter",
+        help="Manage the word filter.",
+        aliases=["wf"],
+        invoke_without_command=True,
+    )
+    @commands.has_guild_permissions(manage_guild=True)
+    async def filter_group(self, ctx, page: typing.Optional[int] = 1):
+        rules = sorted(self.matcher.rules.items())
+        pages = max(math.ceil(len(rules) / 20), 1)
+        if page < 1 or page > pages:
+            await ctx.send("That page doesn't exist.")
+            return True
+        embed = discord.Embed(
+            title=f"Filter rules (page {page}/{pages})",
+            colour=discord.Colour(0x404ADD),
+            timestamp=datetime.datetime.utcnow(),
+        )
+        if rules:
+            embed.description = ""
+            for rule_id, (rule_type, pattern, action) in rules[
+                (page - 1) * 20 : page * 20
+            ]:
+                embed.description += (
+                    f"**#{rule_id}** {rule_type} `{pattern}` → {action}\n"
+                )
+        else:
+            embed.description = (
+                f"There are no filter rules. Add one with `{ctx.prefix}filter add`."
+            )
+        embed.set_footer(text=f"{len(rules)} rules")
+        await ctx.send(embed=embed)
+
+    @filter_group.command(name="add", help="Add a filter rule.")
+    async def filter_add(self, ctx, rule_type: str, action: str, *, pattern: str):
+        rule_type = rule_type.lower()
+        action = action.lower()
+        pattern = pattern.lower().strip()
+        if rule_type not in RULE_TYPES:
+            await ctx.send(
+                f"Invalid rule type `{rule_type}`, must be one of {', '.join(RULE_TYPES)}."
+            )
+            return True
+        if action not in RULE_ACTIONS:
+            await ctx.send(
+                f"Invalid action `{action}`, must be one of {', '.join(RULE_ACTIONS)}."
+            )
+            return True
+        if rule_type == "invite":
+            # accept full invite links as well as bare codes
+            match = invite_match.search(pattern)
+            if match:
+                pattern = match.group(1)
+        if not pattern or len(pattern) > 100:
+            await ctx.send("Patterns must be between 1 and 100 characters.")
+            return True
+        if rule_type == "word" and not word_match.fullmatch(pattern):
+            await ctx.send("Word rules must be a single word.")
+            return True
+        if rule_type == "wildcard" and not (
+            wildcard_pattern_match.fullmatch(pattern) and pattern.strip(WILDCARD)
+        ):
+            await ctx.send(
+                "Wildcard rules must be a single word, using `*` for any letters."
+            )
+            return True
+        rule_id = await self.conn.add_filter_rule(
+            rule_type, pattern, action, ctx.author.id
+        )
+        self.matcher.add(rule_id, rule_type, pattern, action)
+        await ctx.send(
+            f"✅ Added filter rule #{rule_id}: {rule_type} `{pattern}` → {action}."
+        )
+
+    @filter_add.error
+    async def filter_add_error(self, ctx, error):
+        if isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send(
+                f"```{ctx.prefix}filter add <type: word|wildcard|invite> <action: delete|warn|mute> <pattern: str>```\nError: missing required parameter `{error.param.name}`"
+            )
+
+    @filter_group.command(name="remove", help="Remove a filter rule.")
+    async def filter_remove(self, ctx, rule_id: int):
+        rule = await self.conn.remove_filter_rule(rule_id)
+        if not rule:
+            await ctx.send(f"There is no filter rule #{rule_id}.")
+            return True
+        if rule_id in self.matcher.rules:
+            self.matcher.remove(rule_id)
+        await ctx.send(f"✅ Removed filter rule #{rule_id}.")
+
+    @filter_remove.error
+    async def filter_remove_error(self, ctx, error):
+        if isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send(
+                f"```{ctx.prefix}filter remove <id: int>```\nError: missing required parameter `{error.param.name}`"
+            )
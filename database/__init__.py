@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from database.base import DatabaseConn
+
+
+async def init_dbconn(database_url, database_config: dict = None) -> DatabaseConn:
+    # backends are only imported when used, so the memory backend works without a postgres driver
+    if database_url.startswith("memory://"):
+        from database.memory import MemoryConn as backend
+    else:
+        from database.database import PostgresConn as backend
+    dbconn = backend(database_url, database_config)
+    await dbconn._init()
+    return dbconn
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import abc
+import datetime
+
+from database.cache import CacheRegistry
+from database.stats import DatabaseStats
+from database.unit_of_work import UnitOfWork
+
+DATABASE_VERSION = 22
+
+
+class DatabaseConn(abc.ABC):
+    """Everything the cogs store, independent of where it's stored.
+
+    Rows are returned as the row classes in database.rows, so they can be
+    indexed by position, in the column order of the migrations, or accessed
+    by column name as attributes. See database.database for the Postgres
+    backend and database.memory for the in-process one.
+    """
+
+    def __init__(self, database_url, database_config: dict = None):
+        self.database_url = database_url
+        # the [database] section of the config
+        self.config = database_config or {}
+        self.stats = DatabaseStats(self.config.get("slow_query_threshold", 0))
+        self.cache = CacheRegistry(type(self))
+
+    async def _init(self):
+        pass
+
+    async def close(self):
+        """Flush anything buffered and close the connection, on shutdown."""
+
+    def get_version(self):
+        return DATABASE_VERSION
+
+    # interview functions
+
+    @abc.abstractmethod
+    async def create_interview(
+        self, user_id: int, channel_id: int, welcome_message_id: int
+    ): ...
+
+    @abc.abstractmethod
+    async def get_interview(self, user_id: int): ...
+
+    @abc.abstractmethod
+    async def get_interview_from_channel(self, channel_id: int): ...
+
+    @abc.abstractmethod
+    async def get_all_interviews(self): ...
+
+    @abc.abstractmethod
+    async def delete_interview_entry(self, user_or_channel_id: int): ...
+
+    @abc.abstractmethod
+    async def increment_question(self, question: int, channel_id: int): ...
+
+    @abc.abstractmethod
+    async def queue_increment_question(self, question: int, channel_id: int):
+        """Like increment_question, but written in the background, see database.write_behind."""
+
+    # interview question functions
+
+    @abc.abstractmethod
+    async def get_interview_questions(self):
+        """Return all interview questions, in the order they're asked."""
+
+    @abc.abstractmethod
+    async def seed_interview_questions(self, questions: list) -> bool:
+        """Add the questions if the questions were never seeded before, returning whether they were.
+
+        This only happens once, so removing every question doesn't bring these back.
+        """
+
+    @abc.abstractmethod
+    async def add_interview_question(self, question: str) -> int:
+        """Add a question after all existing ones, returning its id."""
+
+    @abc.abstractmethod
+    async def remove_interview_question(self, question_id: int):
+        """Remove a question, returning the removed row or None."""
+
+    # delayed job functions
+
+    @abc.abstractmethod
+    async def add_delayed_job(
+        self,
+        job_type: str,
+        channel_id: int,
+        user_id: int,
+        message_id: int,
+        run_at: datetime.datetime,
+    ) -> int: ...
+
+    @abc.abstractmethod
+    async def get_due_delayed_jobs(self):
+        """Return all jobs whose run_at has passed, oldest first."""
+
+    @abc.abstractmethod
+    async def advance_delayed_job(
+        self, job_id: int, step: int, run_at: datetime.datetime
+    ): ...
+
+    @abc.abstractmethod
+    async def delete_delayed_jobs(self, channel_id: int): ...
+
+    # starboard functions
+
+    @abc.abstractmethod
+    async def get_starboard_settings(self): ...
+
+    @abc.abstractmethod
+    async def set_starboard_channel(self, channel_id: int): ...
+
+    @abc.abstractmethod
+    async def set_starboard_emoji(self, emoji: str): ...
+
+    @abc.abstractmethod
+    async def set_starboard_limit(self, limit: int): ...
+
+    @abc.abstractmethod
+    async def get_starboard_message(self, message_id: int): ...
+
+    @abc.abstractmethod
+    async def set_starboard_message(self, message_id: int, starboard_id: int): ...
+
+    @abc.abstractmethod
+    async def delete_starboard_entry(self, message_id: int): ...
+
+    # note functions
+
+    @abc.abstractmethod
+    async def add_note(self, user_id: int, added_by: int, note: str): ...
+
+    @abc.abstractmethod
+    async def del_note(self, note_id: int): ...
+
+    @abc.abstractmethod
+    async def list_notes(self, user_id: int): ...
+
+    # blacklist functions
+
+    @abc.abstractmethod
+    async def add_to_blacklist(self, channel): ...
+
+    @abc.abstractmethod
+    async def remove_from_blacklist(self, channel): ...
+
+    @abc.abstractmethod
+    async def get_blacklist(self) -> list: ...
+
+    async def channel_not_blacklisted(self, channel_id: int):
+        blacklist = await self.get_blacklist()
+        return channel_id not in blacklist
+
+    # moderation functions
+
+    @abc.abstractmethod
+    async def add_to_mod_logs(
+        self, user_id: int, mod_id: int, action_type: str, reason: str
+    ) -> int:
+        """Add a mod log entry, returning its case id."""
+
+    @abc.abstractmethod
+    async def commit_work(self, work: UnitOfWork):
+        """Apply a unit of work in one transaction, returning the new case id if it logged one."""
+
+    @abc.abstractmethod
+    async def set_pending_action(
+        self,
+        user_id: int,
+        action_type: str,
+        roles_to_remove: list,
+        roles_to_add: list,
+        action_time: datetime.datetime,
+        add_to_log: bool = True,
+    ): ...
+
+    @abc.abstractmethod
+    async def delete_pending_action(self, action_id: int): ...
+
+    @abc.abstractmethod
+    async def get_pending_actions(self): ...
+
+    @abc.abstractmethod
+    async def get_due_pending_actions(self): ...
+
+    @abc.abstractmethod
+    async def get_mute(self, user_id: int): ...
+
+    @abc.abstractmethod
+    async def get_logs_for_user(self, user_id: int): ...
+
+    @abc.abstractmethod
+    async def get_dossier(
+        self, user_id: int, action_limit: int = 5, note_limit: int = 5
+    ):
+        """Return a user's log and note counts, their most recent logs and notes,
+        their latest pending action and their open ticket count.
+
+        Logs, notes and the pending action are dicts as decoded from JSON, so
+        their timestamps are ISO 8601 strings.
+        """
+
+    # highlights
+
+    @abc.abstractmethod
+    async def add_highlight(self, user_id: int, highlight: str): ...
+
+    @abc.abstractmethod
+    async def remove_highlight(self, user_id: int, highlight: str): ...
+
+    @abc.abstractmethod
+    async def get_highlights_for_user(self, user_id: int): ...
+
+    @abc.abstractmethod
+    async def get_all_highlights(self): ...
+
+    # ticket functions
+
+    @abc.abstractmethod
+    async def get_ticket_settings(self): ...
+
+    @abc.abstractmethod
+    async def set_ticket_channel(self, channel_id: int): ...
+
+    @abc.abstractmethod
+    async def set_ticket_message(self, message_id: int): ...
+
+    @abc.abstractmethod
+    async def add_ticket_channel(self, channel_id: int, user_id: int): ...
+
+    @abc.abstractmethod
+    async def remove_ticket_channel(self, channel_id: int): ...
+
+    @abc.abstractmethod
+    async def set_ticket_closed(self, channel_id: int, closed: bool): ...
+
+    @abc.abstractmethod
+    async def get_tickets_for_user(self, user_id: int) -> int: ...
+
+    @abc.abstractmethod
+    async def count_open_tickets(self, user_id: int) -> int: ...
+
+    @abc.abstractmethod
+    async def get_ticket(self, channel_id): ...
+
+    # role functions
+
+    @abc.abstractmethod
+    async def add_role(self, role_id: int): ...
+
+    @abc.abstractmethod
+    async def del_role(self, role_id: int): ...
+
+    @abc.abstractmethod
+    async def fetch_roles(self) -> tuple: ...
+
+    # lockdown functions
+
+    @abc.abstractmethod
+    async def add_lockdown_snapshots(self, snapshots: list):
+        """Save (channel_id, overwrites) snapshots, keeping any existing snapshot of a channel."""
+
+    @abc.abstractmethod
+    async def get_lockdown_snapshots(self, channel_ids: list): ...
+
+    @abc.abstractmethod
+    async def delete_lockdown_snapshots(self, channel_ids: list): ...
+
+    # word filter functions
+
+    @abc.abstractmethod
+    async def add_filter_rule(
+        self, rule_type: str, pattern: str, action: str, added_by: int
+    ) -> int: ...
+
+    @abc.abstractmethod
+    async def remove_filter_rule(self, rule_id: int):
+        """Remove a filter rule, returning the removed row or None."""
+
+    @abc.abstractmethod
+    async def get_filter_rules(self): ...
+
+    # export commands
+
+    @abc.abstractmethod
+    async def export_all(self): ...
+
+    @abc.abstractmethod
+    async def export_user(self, user_id: int): ...
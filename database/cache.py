@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import functools
+
+from cachetools import TTLCache
+
+_missing = object()
+
+
+class MethodCache:
+    """The cache for one DatabaseConn read method.
+
+    Results are cached by the method's arguments. Empty results (None) are
+    cached separately for `negative_ttl` seconds, so lookups for things that
+    don't exist (like a channel that isn't an interview) don't hit the
+    database every time either.
+    """
+
+    def __init__(self, ttl: float, maxsize: int, negative_ttl: float):
+        self.values = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.negative = (
+            TTLCache(maxsize=maxsize, ttl=negative_ttl) if negative_ttl else None
+        )
+        self.hits = 0
+        self.misses = 0
+        # bumped on every invalidation, so a read that raced with a write isn't cached
+        self.generation = 0
+
+    def get(self, key):
+        value = self.values.get(key, _missing)
+        if value is _missing and self.negative is not None and key in self.negative:
+            value = None
+        if value is _missing:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if value is None:
+            if self.negative is not None:
+                self.negative[key] = True
+        else:
+            self.values[key] = value
+
+    def evict(self, key):
+        self.generation += 1
+        self.values.pop(key, None)
+        if self.negative is not None:
+            self.negative.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self.values.clear()
+        if self.negative is not None:
+            self.negative.clear()
+
+
+class CacheRegistry:
+    """All method caches of one DatabaseConn, built from its @cached methods."""
+
+    def __init__(self, cls):
+        self.caches = {}
+        for name in dir(cls):
+            options = getattr(getattr(cls, name), "cache_options", None)
+            if options:
+                self.caches[name] = MethodCache(**options)
+
+    def invalidate(self, name: str, key=_missing):
+        cache = self.caches[name]
+        if key is _missing:
+            cache.clear()
+        else:
+            cache.evict(key)
+
+    def clear(self):
+        for cache in self.caches.values():
+            cache.clear()
+
+    def stats(self) -> dict:
+        return {
+            name: (cache.hits, cache.misses, len(cache.values))
+            for name, cache in self.caches.items()
+        }
+
+
+def cached(ttl: float, maxsize: int = 128, negative_ttl: float = 0):
+    """Cache the results of a DatabaseConn read method, keyed by its arguments.
+
+    Cached results are shared between callers, so they must not be modified.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args):
+            cache = self.cache.caches[method.__name__]
+            value = cache.get(args)
+            if value is _missing:
+                generation = cache.generation
+                value = await method(self, *args)
+                if generation == cache.generation:
+                    cache.set(args, value)
+            return value
+
+        wrapper.cache_options = {
+            "ttl": ttl,
+            "maxsize": maxsize,
+            "negative_ttl": negative_ttl,
+        }
+        return wrapper
+
+    return decorator
+
+
+def invalidates(*targets):
+    """Declare which caches a DatabaseConn write method makes stale.
+
+    A target is either the name of a cached method, to clear its whole cache,
+    or a (name, argument index) tuple, to evict only the entry keyed by that
+    argument of the write.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                # invalidate even if the write failed, it may have partially applied
+                for target in targets:
+                    if isinstance(target, tuple):
+                        name, index = target
+                        self.cache.invalidate(name, (args[index],))
+                    else:
+                        self.cache.invalidate(target)
+
+        return wrapper
+
+    return decorator
@@ -16,41 +16,199 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
 import datetime
-from functools import reduce
-import operator
+import json
+import logging
+import time
 
 import aiopg
 import psycopg2
-
-
-DATABASE_VERSION = 16
-
-
-async def init_dbconn(database_url):
-    dbconn = DatabaseConn(database_url)
-    await dbconn._init()
-    return dbconn
-
-
-class DatabaseConn:
-    def __init__(self, database_url):
-        self.database_url = database_url
-
+import psycopg2.extras
+
+from database import rows
+from database.base import DATABASE_VERSION, DatabaseConn
+from database.cache import cached, invalidates
+from database.migrate import migrate
+from database.stats import instrument, timed_acquire
+from database.unit_of_work import UnitOfWork
+from database.write_behind import WriteBehindBuffer
+
+logger = logging.getLogger("discord.database")
+
+# cached methods to invalidate when a table changes, see migration 20
+# methods marked True are keyed by the row's key column, the others are cleared completely
+INVALIDATION_TABLES = {
+    "starboard": {"get_starboard_settings": False},
+    "tickets_config": {"get_ticket_settings": False},
+    "blacklisted_channels": {"get_blacklist": False},
+    "selfroles": {"fetch_roles": False},
+    "highlights": {"get_highlights_for_user": True, "get_all_highlights": False},
+    "interviews": {"get_interview_from_channel": True},
+    "tickets": {"get_ticket": True, "count_open_tickets": False},
+}
+
+# the statements behind the writes a UnitOfWork can queue
+WORK_STATEMENTS = {
+    "add_to_mod_logs": "INSERT INTO modactions (user_id, mod_id, type, reason) VALUES (%s, %s, %s, %s) RETURNING id",
+    "set_pending_action": "INSERT INTO pending_actions (user_id, type, roles_to_remove, roles_to_add, action_time, add_to_log) VALUES (%s, %s, %s, %s, %s, %s)",
+    "delete_pending_action": "DELETE FROM pending_actions WHERE id = %s",
+}
+
+# batched statements for the writes buffered by WriteBehindBuffer,
+# as (statement with a {} for the rows, one row of values)
+WRITE_BEHIND_STATEMENTS = {
+    "increment_question": (
+        "UPDATE interviews SET current_question = v.question FROM (VALUES {}) AS v (question, channel_id) WHERE interviews.channel_id = v.channel_id",
+        "(%s::int, %s::bigint)",
+    ),
+}
+# the cached method whose entries (keyed by the write's key) each kind of write changes
+WRITE_BEHIND_INVALIDATES = {"increment_question": "get_interview_from_channel"}
+
+
+@instrument
+class PostgresConn(DatabaseConn):
     async def _init(self):
+        start = time.perf_counter()
+        statement_timeout = self.config.get("statement_timeout", 30000)
+        # plain cursors return tuples, which are made into the compact row classes in database.rows
         self.pool = await aiopg.create_pool(
-            self.database_url, cursor_factory=psycopg2.extras.DictCursor
+            self.database_url,
+            minsize=self.config.get("pool_minsize", 2),
+            maxsize=self.config.get("pool_maxsize", 10),
+            pool_recycle=self.config.get("pool_recycle", 3600),
+            options=f"-c statement_timeout={statement_timeout}",
         )
-        await self.init_db_if_not_initialised()
+        self.acquire_timeout = self.config.get("acquire_timeout", 10) or None
+        self.write_behind = WriteBehindBuffer(
+            self._flush_writes,
+            self.config.get("write_behind_maxsize", 1000),
+            self.config.get("write_behind_interval", 5),
+            self._invalidate_flushed,
+        )
+        self.write_behind.start()
         await self.update_db()
+        await self._warm_up()
+        logger.log(
+            logging.INFO,
+            f"Connected to the database in {(time.perf_counter() - start) * 1000:.1f}ms",
+        )
+        self.listener = asyncio.ensure_future(self._listen_for_invalidations())
+        self.health_check = None
+        health_check_interval = self.config.get("health_check_interval", 60)
+        if health_check_interval:
+            self.health_check = asyncio.ensure_future(
+                self._check_pool_health(health_check_interval)
+            )
+
+    async def close(self):
+        await self.write_behind.close()
+        self.listener.cancel()
+        if self.health_check:
+            self.health_check.cancel()
+        self.pool.close()
+        await self.pool.wait_closed()
+
+    async def _flush_writes(self, writes: dict):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                statements = []
+                for kind, rows_args in writes.items():
+                    statement, values = WRITE_BEHIND_STATEMENTS[kind]
+                    statements.append(
+                        cur.mogrify(
+                            statement.format(", ".join([values] * len(rows_args))),
+                            [arg for args in rows_args for arg in args],
+                        )
+                    )
+                # one round trip, and a single transaction, for the whole batch
+                await cur.execute(b";\n".join(statements).decode())
+
+    def _invalidate_flushed(self, keys: list):
+        # reads that ran while the batch was written are cached with the old row
+        for kind, key in keys:
+            self.cache.invalidate(WRITE_BEHIND_INVALIDATES[kind], (key,))
+
+    async def _ping(self, conn) -> bool:
+        try:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT 1", timeout=5)
+            return True
+        except Exception:
+            return False
+
+    async def _warm_up(self):
+        # open and test all minsize connections now, so the first events after
+        # startup don't have to wait for connection setup
+        async def warm_up_connection():
+            async with self.pool.acquire() as conn:
+                if not await self._ping(conn):
+                    conn.close()
+
+        await asyncio.gather(*(warm_up_connection() for _ in range(self.pool.minsize)))
+
+    async def _check_pool_health(self, interval: float):
+        # idle connections can be cut off by the server or the network without the pool
+        # noticing, so ping each one and close the broken ones. the pool drops closed
+        # connections when they're released, and warming up refills it
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                broken = 0
+                # the pool hands out free connections in order, so this pings each of them once
+                for _ in range(self.pool.freesize):
+                    async with self.pool.acquire() as conn:
+                        if not await self._ping(conn):
+                            conn.close()
+                            broken += 1
+                if broken:
+                    logger.log(
+                        logging.WARN, f"Replacing {broken} broken database connections"
+                    )
+                    await self._warm_up()
+            except Exception as e:
+                logger.log(logging.WARN, f"Database health check failed: {e}")
+
+    async def _listen_for_invalidations(self):
+        # other bot processes and manual fixes change rows behind our back, so listen
+        # for the notifications the tables' triggers send and evict what they changed
+        while True:
+            try:
+                async with aiopg.connect(self.database_url) as conn:
+                    async with conn.cursor() as cur:
+                        await cur.execute("LISTEN cache_invalidation")
+                    # notifications sent while we weren't listening are lost
+                    self.cache.clear()
+                    while True:
+                        notification = await conn.notifies.get()
+                        self._invalidate_from_notification(notification.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.log(
+                    logging.WARN,
+                    f"Cache invalidation listener failed, reconnecting in 5 seconds: {e}",
+                )
+                await asyncio.sleep(5)
 
-    def get_version(self):
-        return DATABASE_VERSION
+    def _invalidate_from_notification(self, payload: str):
+        change = json.loads(payload)
+        for name, keyed in INVALIDATION_TABLES.get(change["table"], {}).items():
+            if keyed and change["key"] is not None:
+                self.cache.invalidate(name, (int(change["key"]),))
+            else:
+                self.cache.invalidate(name)
 
+    def acquire(self):
+        # acquire a pool connection, timing the wait and the queries run on it
+        return timed_acquire(self.pool, self.acquire_timeout)
+
+    @invalidates(("get_interview_from_channel", 1))
     async def create_interview(
         self, user_id: int, channel_id: int, welcome_message_id: int
     ):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "INSERT INTO interviews (user_id, channel_id, welcome_message) VALUES (%s, %s, %s)",
@@ -58,79 +216,203 @@ class DatabaseConn:
                 )
 
     async def get_interview(self, user_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "SELECT * FROM interviews WHERE user_id = %s",
                     (user_id,),
                 )
-                return await cur.fetchone()
+                return self._with_buffered_question(
+                    rows.one(rows.Interview, await cur.fetchone())
+                )
 
+    @cached(ttl=300, maxsize=1000, negative_ttl=60)
     async def get_interview_from_channel(self, channel_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "SELECT * FROM interviews WHERE channel_id = %s",
                     (channel_id,),
                 )
-                return await cur.fetchone()
+                return self._with_buffered_question(
+                    rows.one(rows.Interview, await cur.fetchone())
+                )
 
+    async def get_all_interviews(self):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT * FROM interviews")
+                return [
+                    self._with_buffered_question(interview)
+                    for interview in rows.many(rows.Interview, await cur.fetchall())
+                ]
+
+    def _with_buffered_question(self, interview):
+        # reads have to see questions that were incremented but not flushed yet
+        if interview is not None:
+            buffered = self.write_behind.get("increment_question", interview.channel_id)
+            if buffered:
+                interview = interview._replace(current_question=buffered[0])
+        return interview
+
+    @invalidates("get_interview_from_channel")
     async def delete_interview_entry(self, user_or_channel_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "DELETE FROM interviews WHERE channel_id = %s OR user_id = %s",
                     (user_or_channel_id, user_or_channel_id),
                 )
 
+    @invalidates(("get_interview_from_channel", 1))
     async def increment_question(self, question: int, channel_id: int):
-        async with self.pool.acquire() as conn:
+        self.write_behind.discard("increment_question", channel_id)
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "UPDATE interviews SET current_question = %s WHERE channel_id = %s",
                     (question, channel_id),
                 )
 
+    async def queue_increment_question(self, question: int, channel_id: int):
+        await self.write_behind.put(
+            "increment_question", channel_id, (question, channel_id)
+        )
+        self.cache.invalidate("get_interview_from_channel", (channel_id,))
+
+    # interview question functions
+
+    async def get_interview_questions(self):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT * FROM interview_questions ORDER BY id")
+                return rows.many(rows.InterviewQuestion, await cur.fetchall())
+
+    async def seed_interview_questions(self, questions: list) -> bool:
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                # claiming the flag and inserting is one statement, so it can only happen once
+                await cur.execute(
+                    """
+                    WITH claim AS (
+                        UPDATE info SET interview_questions_seeded = true
+                        WHERE NOT interview_questions_seeded RETURNING 1
+                    ), inserted AS (
+                        INSERT INTO interview_questions (id, question)
+                        SELECT q.id + (SELECT coalesce(max(id), 0) FROM interview_questions), q.question
+                        FROM unnest(%s::text[]) WITH ORDINALITY AS q (question, id), claim
+                    )
+                    SELECT count(*) FROM claim
+                    """,
+                    (questions,),
+                )
+                return (await cur.fetchone())[0] > 0
+
+    async def add_interview_question(self, question: str) -> int:
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "INSERT INTO interview_questions (id, question) SELECT coalesce(max(id), 0) + 1, %s FROM interview_questions RETURNING id",
+                    (question,),
+                )
+                return (await cur.fetchone())[0]
+
+    async def remove_interview_question(self, question_id: int):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "DELETE FROM interview_questions WHERE id = %s RETURNING *",
+                    (question_id,),
+                )
+                return rows.one(rows.InterviewQuestion, await cur.fetchone())
+
+    # delayed job functions
+
+    async def add_delayed_job(
+        self,
+        job_type: str,
+        channel_id: int,
+        user_id: int,
+        message_id: int,
+        run_at: datetime.datetime,
+    ) -> int:
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "INSERT INTO delayed_jobs (type, channel_id, user_id, message_id, run_at) VALUES (%s, %s, %s, %s, %s) RETURNING id",
+                    (job_type, channel_id, user_id, message_id, run_at),
+                )
+                return (await cur.fetchone())[0]
+
+    async def get_due_delayed_jobs(self):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT * FROM delayed_jobs WHERE run_at < (current_timestamp at time zone 'utc') ORDER BY run_at"
+                )
+                return rows.many(rows.DelayedJob, await cur.fetchall())
+
+    async def advance_delayed_job(
+        self, job_id: int, step: int, run_at: datetime.datetime
+    ):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "UPDATE delayed_jobs SET step = %s, run_at = %s WHERE id = %s",
+                    (step, run_at, job_id),
+                )
+
+    async def delete_delayed_jobs(self, channel_id: int):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "DELETE FROM delayed_jobs WHERE channel_id = %s", (channel_id,)
+                )
+
     # starboard functions
 
+    @cached(ttl=3600)
     async def get_starboard_settings(self):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute("SELECT * FROM starboard")
-                return await cur.fetchone()
+                return rows.one(rows.StarboardSettings, await cur.fetchone())
 
+    @invalidates("get_starboard_settings")
     async def set_starboard_channel(self, channel_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "UPDATE starboard SET channel = %s WHERE id = 1", (channel_id,)
                 )
 
+    @invalidates("get_starboard_settings")
     async def set_starboard_emoji(self, emoji: str):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "UPDATE starboard SET emoji = %s WHERE id = 1", (emoji,)
                 )
 
+    @invalidates("get_starboard_settings")
     async def set_starboard_limit(self, limit: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "UPDATE starboard SET star_limit = %s WHERE id = 1", (limit,)
                 )
 
     async def get_starboard_message(self, message_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "SELECT * FROM starboard_messages WHERE message_id = %s",
                     (message_id,),
                 )
-                return await cur.fetchone()
+                return rows.one(rows.StarboardMessage, await cur.fetchone())
 
     async def set_starboard_message(self, message_id: int, starboard_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "INSERT INTO starboard_messages (message_id, starboard_id) VALUES (%s, %s)",
@@ -138,7 +420,7 @@ class DatabaseConn:
                 )
 
     async def delete_starboard_entry(self, message_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "DELETE FROM starboard_messages WHERE message_id = %s OR starboard_id = %s",
@@ -148,7 +430,7 @@ class DatabaseConn:
     # note functions
 
     async def add_note(self, user_id: int, added_by: int, note: str):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "INSERT INTO notes (user_id, set_by, reason) VALUES (%s, %s, %s)",
@@ -156,36 +438,39 @@ class DatabaseConn:
                 )
 
     async def del_note(self, note_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute("DELETE FROM notes WHERE id = %s", (note_id,))
 
     async def list_notes(self, user_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute("SELECT * FROM notes WHERE user_id = %s", (user_id,))
-                return await cur.fetchall()
+                return rows.many(rows.Note, await cur.fetchall())
 
     # blacklist functions
 
+    @invalidates("get_blacklist")
     async def add_to_blacklist(self, channel):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "INSERT INTO blacklisted_channels (channel_id) VALUES (%s)",
                     (channel,),
                 )
 
+    @invalidates("get_blacklist")
     async def remove_from_blacklist(self, channel):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "DELETE FROM blacklisted_channels WHERE channel_id = %s",
                     (int(channel),),
                 )
 
+    @cached(ttl=3600)
     async def get_blacklist(self):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute("SELECT channel_id FROM blacklisted_channels")
                 channels = await cur.fetchall()
@@ -195,21 +480,37 @@ class DatabaseConn:
 
                 return channel_list
 
-    async def channel_not_blacklisted(self, channel_id: int):
-        blacklist = await self.get_blacklist()
-        return channel_id not in blacklist
-
     # moderation functions
 
     async def add_to_mod_logs(
         self, user_id: int, mod_id: int, action_type: str, reason: str
-    ):
-        async with self.pool.acquire() as conn:
+    ) -> int:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
-                    "INSERT INTO modactions (user_id, mod_id, type, reason) VALUES (%s, %s, %s, %s)",
+                    WORK_STATEMENTS["add_to_mod_logs"],
                     (user_id, mod_id, action_type, reason),
                 )
+                return (await cur.fetchone())[0]
+
+    async def commit_work(self, work: UnitOfWork):
+        operations = work.all_operations()
+        if not operations:
+            return None
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                # postgres runs a multi-statement query as a single transaction,
+                # so this is atomic and only takes one round trip
+                query = ";\n".join(
+                    [
+                        cur.mogrify(WORK_STATEMENTS[name], args).decode()
+                        for name, args in operations
+                    ]
+                )
+                await cur.execute(query)
+                if work.log_entry:
+                    return (await cur.fetchone())[0]
+                return None
 
     async def set_pending_action(
         self,
@@ -220,10 +521,10 @@ class DatabaseConn:
         action_time: datetime.datetime,
         add_to_log: bool = True,
     ):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
-                    "INSERT INTO pending_actions (user_id, type, roles_to_remove, roles_to_add, action_time, add_to_log) VALUES (%s, %s, %s, %s, %s, %s)",
+                    WORK_STATEMENTS["set_pending_action"],
                     (
                         user_id,
                         action_type,
@@ -235,39 +536,92 @@ class DatabaseConn:
                 )
 
     async def delete_pending_action(self, action_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
-                    "DELETE FROM pending_actions WHERE id = %s", (action_id,)
+                    WORK_STATEMENTS["delete_pending_action"], (action_id,)
                 )
 
     async def get_pending_actions(self):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute("SELECT * FROM pending_actions")
-                return await cur.fetchall()
+                return rows.many(rows.PendingAction, await cur.fetchall())
+
+    async def get_due_pending_actions(self):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT * FROM pending_actions WHERE action_time < (current_timestamp at time zone 'utc')"
+                )
+                return rows.many(rows.PendingAction, await cur.fetchall())
 
     async def get_mute(self, user_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "select * from pending_actions where type::text = any (array['mute', 'hardmute']) and user_id = %s",
                     (user_id,),
                 )
-                return await cur.fetchone()
+                return rows.one(rows.PendingAction, await cur.fetchone())
 
     async def get_logs_for_user(self, user_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "SELECT * FROM modactions WHERE user_id = %s", (user_id,)
                 )
-                return await cur.fetchall()
+                return rows.many(rows.ModAction, await cur.fetchall())
+
+    async def get_dossier(
+        self, user_id: int, action_limit: int = 5, note_limit: int = 5
+    ):
+        # everything a moderator needs to review a user, in one round trip
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    WITH recent_actions AS (
+                        SELECT id, mod_id, type::text AS type, reason, created
+                        FROM modactions WHERE user_id = %(user_id)s
+                        ORDER BY id DESC LIMIT %(action_limit)s
+                    ), action_count AS (
+                        SELECT count(*) AS total FROM modactions WHERE user_id = %(user_id)s
+                    ), recent_notes AS (
+                        SELECT id, set_by, reason, created
+                        FROM notes WHERE user_id = %(user_id)s
+                        ORDER BY id DESC LIMIT %(note_limit)s
+                    ), note_count AS (
+                        SELECT count(*) AS total FROM notes WHERE user_id = %(user_id)s
+                    ), active_action AS (
+                        SELECT id, type::text AS type, action_time
+                        FROM pending_actions WHERE user_id = %(user_id)s
+                        ORDER BY action_time DESC LIMIT 1
+                    ), ticket_count AS (
+                        SELECT count(*) AS total FROM tickets
+                        WHERE user_id = %(user_id)s AND NOT ticket_closed
+                    )
+                    SELECT
+                        (SELECT total FROM action_count) AS action_count,
+                        (SELECT coalesce(json_agg(a ORDER BY a.id DESC), '[]'::json) FROM recent_actions a) AS actions,
+                        (SELECT total FROM note_count) AS note_count,
+                        (SELECT coalesce(json_agg(n ORDER BY n.id DESC), '[]'::json) FROM recent_notes n) AS notes,
+                        (SELECT row_to_json(p) FROM active_action p) AS pending_action,
+                        (SELECT total FROM ticket_count) AS ticket_count
+                    """,
+                    {
+                        "user_id": user_id,
+                        "action_limit": action_limit,
+                        "note_limit": note_limit,
+                    },
+                )
+                return rows.one(rows.Dossier, await cur.fetchone())
 
     # highlights
 
+    @invalidates(("get_highlights_for_user", 0), "get_all_highlights")
     async def add_highlight(self, user_id: int, highlight: str):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "INSERT INTO highlights (user_id, word) VALUES (%s, %s)",
@@ -277,8 +631,9 @@ class DatabaseConn:
                     ),
                 )
 
+    @invalidates(("get_highlights_for_user", 0), "get_all_highlights")
     async def remove_highlight(self, user_id: int, highlight: str):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "DELETE FROM highlights WHERE user_id = %s AND word = %s",
@@ -288,138 +643,209 @@ class DatabaseConn:
                     ),
                 )
 
+    @cached(ttl=3600, maxsize=1000)
     async def get_highlights_for_user(self, user_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "SELECT * FROM highlights WHERE user_id = %s", (user_id,)
                 )
-                return await cur.fetchall()
+                return rows.many(rows.Highlight, await cur.fetchall())
 
+    @cached(ttl=3600)
     async def get_all_highlights(self):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute("SELECT * FROM highlights")
-                return await cur.fetchall()
+                return rows.many(rows.Highlight, await cur.fetchall())
 
     # ticket functions
 
+    @cached(ttl=3600)
     async def get_ticket_settings(self):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute("SELECT * FROM tickets_config")
-                return await cur.fetchone()
+                return rows.one(rows.TicketSettings, await cur.fetchone())
 
+    @invalidates("get_ticket_settings")
     async def set_ticket_channel(self, channel_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "UPDATE tickets_config SET listen_channel = %s WHERE id = 1",
                     (channel_id,),
                 )
 
+    @invalidates("get_ticket_settings")
     async def set_ticket_message(self, message_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "UPDATE tickets_config SET listen_message = %s WHERE id = 1",
                     (message_id,),
                 )
 
+    @invalidates(("get_ticket", 0), ("count_open_tickets", 1))
     async def add_ticket_channel(self, channel_id: int, user_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
-                    "INSERT INTO tickets (channel_id, user_id, ticket_status) VALUES (%s, %s, true)",
+                    "INSERT INTO tickets (channel_id, user_id, ticket_closed) VALUES (%s, %s, false)",
                     (channel_id, user_id),
                 )
 
+    @invalidates(("get_ticket", 0), "count_open_tickets")
     async def remove_ticket_channel(self, channel_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "DELETE FROM tickets WHERE channel_id = %s", (channel_id,)
                 )
 
+    @invalidates(("get_ticket", 0), "count_open_tickets")
+    async def set_ticket_closed(self, channel_id: int, closed: bool):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "UPDATE tickets SET ticket_closed = %s WHERE channel_id = %s",
+                    (closed, channel_id),
+                )
+
     async def get_tickets_for_user(self, user_id: int) -> int:
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
-                    "SELECT * FROM tickets WHERE user_id = %s", (user_id,)
+                    "SELECT count(*) FROM tickets WHERE user_id = %s", (user_id,)
                 )
-                return len(await cur.fetchall())
+                return (await cur.fetchone())[0]
 
+    @cached(ttl=300, maxsize=1000)
+    async def count_open_tickets(self, user_id: int) -> int:
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT count(*) FROM tickets WHERE user_id = %s AND NOT ticket_closed",
+                    (user_id,),
+                )
+                return (await cur.fetchone())[0]
+
+    @cached(ttl=300, maxsize=1000, negative_ttl=60)
     async def get_ticket(self, channel_id):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "SELECT * FROM tickets WHERE channel_id = %s", (channel_id,)
                 )
-                return await cur.fetchone()
+                return rows.one(rows.Ticket, await cur.fetchone())
 
     # role functions
 
+    @invalidates("fetch_roles")
     async def add_role(self, role_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "INSERT INTO selfroles (role_id) VALUES (%s)", (role_id,)
                 )
 
+    @invalidates("fetch_roles")
     async def del_role(self, role_id: int):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
                     "DELETE FROM selfroles WHERE role_id = %s", (role_id,)
                 )
 
+    @cached(ttl=3600)
     async def fetch_roles(self):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute("SELECT role_id FROM selfroles")
-                x = cur.fetchall()
-                x = reduce(operator.concat, x)
-                return x
+                roles = await cur.fetchall()
+                return tuple(role[0] for role in roles)
+
+    # lockdown functions
+
+    async def add_lockdown_snapshots(self, snapshots: list):
+        # snapshots is a list of (channel_id, overwrites) tuples
+        # existing snapshots are kept, so re-locking a channel doesn't overwrite its original state
+        if not snapshots:
+            return
+        values = ", ".join(["(%s, %s)"] * len(snapshots))
+        args = []
+        for channel_id, overwrites in snapshots:
+            args.extend((channel_id, psycopg2.extras.Json(overwrites)))
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    f"INSERT INTO lockdown_snapshots (channel_id, overwrites) VALUES {values} ON CONFLICT (channel_id) DO NOTHING",
+                    args,
+                )
+
+    async def get_lockdown_snapshots(self, channel_ids: list):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT channel_id, overwrites FROM lockdown_snapshots WHERE channel_id = ANY(%s)",
+                    (channel_ids,),
+                )
+                return rows.many(rows.LockdownSnapshot, await cur.fetchall())
+
+    async def delete_lockdown_snapshots(self, channel_ids: list):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "DELETE FROM lockdown_snapshots WHERE channel_id = ANY(%s)",
+                    (channel_ids,),
+                )
+
+    # word filter functions
+
+    async def add_filter_rule(
+        self, rule_type: str, pattern: str, action: str, added_by: int
+    ) -> int:
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "INSERT INTO filter_rules (type, pattern, action, added_by) VALUES (%s, %s, %s, %s) RETURNING id",
+                    (rule_type, pattern, action, added_by),
+                )
+                rule_id = await cur.fetchone()
+                return rule_id[0]
+
+    async def remove_filter_rule(self, rule_id: int):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "DELETE FROM filter_rules WHERE id = %s RETURNING *", (rule_id,)
+                )
+                return rows.one(rows.FilterRule, await cur.fetchone())
+
+    async def get_filter_rules(self):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT * FROM filter_rules ORDER BY id")
+                return rows.many(rows.FilterRule, await cur.fetchall())
 
     # export commands
 
     async def export_all(self):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute("SELECT * FROM modactions")
-                return await cur.fetchall()
-    
-    async def export_user(self, user_id: int):
-        async with self.pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute("SELECT * FROM modactions WHERE user_id = %s", (user_id,))
-                return await cur.fetchall()
+                return rows.many(rows.ModAction, await cur.fetchall())
 
-    # database initialisation functions
-
-    async def init_db_if_not_initialised(self):
-        async with self.pool.acquire() as conn:
+    async def export_user(self, user_id: int):
+        async with self.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(
-                    "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_schema = 'public' AND table_name = 'info')"
+                    "SELECT * FROM modactions WHERE user_id = %s", (user_id,)
                 )
-                exists = await cur.fetchone()
-                if not exists[0]:
-                    await self.init_db()
+                return rows.many(rows.ModAction, await cur.fetchall())
 
-    async def init_db(self):
-        sql_file = open("database/migrations/1.sql", "r")
-        async with self.pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(sql_file.read())
+    # database initialisation functions
 
     async def update_db(self):
-        async with self.pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute("SELECT schema_version FROM info")
-                schema = await cur.fetchone()
-                schema_version = schema[0]
-                while schema_version < DATABASE_VERSION:
-                    schema_version += 1
-                    sql_file = open(f"database/migrations/{schema_version}.sql", "r")
-                    await cur.execute(sql_file.read())
+        async with self.acquire() as conn:
+            return await migrate(conn, DATABASE_VERSION)
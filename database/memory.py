@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import copy
+import datetime
+import json
+
+from database import rows
+from database.base import DatabaseConn
+from database.unit_of_work import UnitOfWork
+
+# values of the modaction enum, see migrations 1 and 12
+MOD_ACTIONS = ("warn", "mute", "pause", "hardmute", "kick", "tempban", "ban", "unmute")
+
+
+# tables that don't have a row class, as their methods only return one column
+BlacklistedChannel = collections.namedtuple("BlacklistedChannel", ("channel_id",))
+SelfRole = collections.namedtuple("SelfRole", ("role_id",))
+# lockdown_snapshots as stored, get_lockdown_snapshots only returns the first two columns
+StoredLockdownSnapshot = collections.namedtuple(
+    "StoredLockdownSnapshot", ("channel_id", "overwrites", "created")
+)
+
+
+class Table:
+    """The rows of one table, in insertion order, as row classes from database.rows.
+
+    Lookups are linear scans, which is plenty for the handful of rows tests
+    and benchmarks create. Rows are immutable tuples, and values are copied
+    on the way in, so callers can't modify stored rows, just like with a real
+    database. Tables with mutable values (arrays, json) set copy_rows to copy
+    those on the way out as well.
+    """
+
+    def __init__(
+        self,
+        row_class,
+        key: str = None,
+        serial: str = None,
+        copy_rows: bool = False,
+        **defaults,
+    ):
+        self.row_class = row_class
+        self.key = key
+        self.serial = serial
+        self.copy_rows = copy_rows
+        self.defaults = defaults
+        self.rows = []
+        self.next_id = 1
+
+    def insert(self, **values):
+        if self.serial:
+            values[self.serial] = self.next_id
+            self.next_id += 1
+        for name, default in self.defaults.items():
+            values.setdefault(name, default() if callable(default) else default)
+        if self.key and self.select(**{self.key: values[self.key]}):
+            raise ValueError(f"duplicate key value {values[self.key]} for {self.key}")
+        row = self.row_class._make(
+            copy.deepcopy(values.get(name)) for name in self.row_class._fields
+        )
+        self.rows.append(row)
+        return self.output(row)
+
+    def output(self, row):
+        return copy.deepcopy(row) if self.copy_rows else row
+
+    def matches(self, row, where: dict) -> bool:
+        return all(getattr(row, name) == value for name, value in where.items())
+
+    def select(self, **where) -> list:
+        return [self.output(row) for row in self.rows if self.matches(row, where)]
+
+    def update(self, values: dict, **where):
+        values = copy.deepcopy(values)
+        self.rows = [
+            row._replace(**values) if self.matches(row, where) else row
+            for row in self.rows
+        ]
+
+    def delete(self, predicate) -> list:
+        deleted = [row for row in self.rows if predicate(row)]
+        self.rows = [row for row in self.rows if not predicate(row)]
+        return deleted
+
+
+def utcnow():
+    return datetime.datetime.utcnow()
+
+
+def json_row(row, columns: tuple) -> dict:
+    # the same shape postgres' row_to_json and json_agg produce
+    return json.loads(
+        json.dumps(
+            {name: getattr(row, name) for name in columns},
+            default=lambda value: value.isoformat(),
+        )
+    )
+
+
+class MemoryConn(DatabaseConn):
+    """A DatabaseConn that keeps everything in memory, for tests and benchmarks.
+
+    Selected with a `memory://` database_url. Every method behaves like its
+    Postgres counterpart, including the initial rows the migrations insert,
+    but nothing is persisted when the bot stops.
+    """
+
+    async def _init(self):
+        self.tables = {
+            "interviews": Table(
+                rows.Interview, key="user_id", current_question=0, welcome_message=0
+            ),
+            "notes": Table(rows.Note, serial="id", created=utcnow),
+            "modactions": Table(rows.ModAction, serial="id", created=utcnow),
+            "tickets": Table(rows.Ticket, serial="id", ticket_closed=True),
+            "starboard": Table(rows.StarboardSettings, key="id"),
+            "starboard_messages": Table(rows.StarboardMessage, key="message_id"),
+            "blacklisted_channels": Table(BlacklistedChannel),
+            "pending_actions": Table(rows.PendingAction, serial="id", copy_rows=True),
+            "highlights": Table(rows.Highlight, serial="id"),
+            "tickets_config": Table(rows.TicketSettings, key="id"),
+            "selfroles": Table(SelfRole, key="role_id"),
+            "lockdown_snapshots": Table(
+                StoredLockdownSnapshot, key="channel_id", copy_rows=True, created=utcnow
+            ),
+            "filter_rules": Table(rows.FilterRule, serial="id", created=utcnow),
+            "interview_questions": Table(rows.InterviewQuestion, key="id"),
+            "delayed_jobs": Table(rows.DelayedJob, serial="id", step=0),
+        }
+        # info.interview_questions_seeded
+        self.interview_questions_seeded = False
+        self.tables["starboard"].insert(id=1, channel=0, star_limit=1000, emoji="⭐")
+        self.tables["tickets_config"].insert(
+            id=1,
+            listen_channel=0,
+            listen_message=0,
+            listen_reaction="📩",
+            welcome_message="{mention} Welcome\\n@here",
+        )
+
+    def first(self, rows: list):
+        return rows[0] if rows else None
+
+    # interview functions
+
+    async def create_interview(
+        self, user_id: int, channel_id: int, welcome_message_id: int
+    ):
+        self.tables["interviews"].insert(
+            user_id=user_id, channel_id=channel_id, welcome_message=welcome_message_id
+        )
+
+    async def get_interview(self, user_id: int):
+        return self.first(self.tables["interviews"].select(user_id=user_id))
+
+    async def get_interview_from_channel(self, channel_id: int):
+        return self.first(self.tables["interviews"].select(channel_id=channel_id))
+
+    async def get_all_interviews(self):
+        return self.tables["interviews"].select()
+
+    async def delete_interview_entry(self, user_or_channel_id: int):
+        self.tables["interviews"].delete(
+            lambda row: user_or_channel_id in (row.user_id, row.channel_id)
+        )
+
+    async def increment_question(self, question: int, channel_id: int):
+        self.tables["interviews"].update(
+            {"current_question": question}, channel_id=channel_id
+        )
+
+    async def queue_increment_question(self, question: int, channel_id: int):
+        # nothing to gain from buffering writes to memory
+        self.tables["interviews"].update(
+            {"current_question": question}, channel_id=channel_id
+        )
+
+    # interview question functions
+
+    async def get_interview_questions(self):
+        return sorted(
+            self.tables["interview_questions"].select(), key=lambda row: row.id
+        )
+
+    async def seed_interview_questions(self, questions: list) -> bool:
+        if self.interview_questions_seeded:
+            return False
+        self.interview_questions_seeded = True
+        for question in questions:
+            await self.add_interview_question(question)
+        return True
+
+    async def add_interview_question(self, question: str) -> int:
+        table = self.tables["interview_questions"]
+        question_id = max((row.id for row in table.rows), default=0) + 1
+        return table.insert(id=question_id, question=question).id
+
+    async def remove_interview_question(self, question_id: int):
+        return self.first(
+            self.tables["interview_questions"].delete(lambda row: row.id == question_id)
+        )
+
+    # delayed job functions
+
+    async def add_delayed_job(
+        self,
+        job_type: str,
+        channel_id: int,
+        user_id: int,
+        message_id: int,
+        run_at: datetime.datetime,
+    ) -> int:
+        return (
+            self.tables["delayed_jobs"]
+            .insert(
+                type=job_type,
+                channel_id=channel_id,
+                user_id=user_id,
+                message_id=message_id,
+                run_at=run_at,
+            )
+            .id
+        )
+
+    async def get_due_delayed_jobs(self):
+        now = utcnow()
+        return sorted(
+            (row for row in self.tables["delayed_jobs"].select() if row.run_at < now),
+            key=lambda row: row.run_at,
+        )
+
+    async def advance_delayed_job(
+        self, job_id: int, step: int, run_at: datetime.datetime
+    ):
+        self.tables["delayed_jobs"].update({"step": step, "run_at": run_at}, id=job_id)
+
+    async def delete_delayed_jobs(self, channel_id: int):
+        self.tables["delayed_jobs"].delete(lambda row: row.channel_id == channel_id)
+
+    # starboard functions
+
+    async def get_starboard_settings(self):
+        return self.first(self.tables["starboard"].select())
+
+    async def set_starboard_channel(self, channel_id: int):
+        self.tables["starboard"].update({"channel": channel_id}, id=1)
+
+    async def set_starboard_emoji(self, emoji: str):
+        self.tables["starboard"].update({"emoji": emoji}, id=1)
+
+    async def set_starboard_limit(self, limit: int):
+        self.tables["starboard"].update({"star_limit": limit}, id=1)
+
+    async def get_starboard_message(self, message_id: int):
+        return self.first(
+            self.tables["starboard_messages"].select(message_id=message_id)
+        )
+
+    async def set_starboard_message(self, message_id: int, starboard_id: int):
+        self.tables["starboard_messages"].insert(
+            message_id=message_id, starboard_id=starboard_id
+        )
+
+    async def delete_starboard_entry(self, message_id: int):
+        self.tables["starboard_messages"].delete(lambda row: message_id in row)
+
+    # note functions
+
+    async def add_note(self, user_id: int, added_by: int, note: str):
+        self.tables["notes"].insert(user_id=user_id, set_by=added_by, reason=note)
+
+    async def del_note(self, note_id: int):
+        self.tables["notes"].delete(lambda row: row.id == note_id)
+
+    async def list_notes(self, user_id: int):
+        return self.tables["notes"].select(user_id=user_id)
+
+    # blacklist functions
+
+    async def add_to_blacklist(self, channel):
+        self.tables["blacklisted_channels"].insert(channel_id=int(channel))
+
+    async def remove_from_blacklist(self, channel):
+        self.tables["blacklisted_channels"].delete(
+            lambda row: row.channel_id == int(channel)
+        )
+
+    async def get_blacklist(self) -> list:
+        return [row.channel_id for row in self.tables["blacklisted_channels"].select()]
+
+    # moderation functions
+
+    async def add_to_mod_logs(
+        self, user_id: int, mod_id: int, action_type: str, reason: str
+    ) -> int:
+        if action_type not in MOD_ACTIONS:
+            raise ValueError(f"invalid mod action type {action_type}")
+        return self.tables["modactions"].insert(
+            user_id=user_id, mod_id=mod_id, type=action_type, reason=reason
+        )[0]
+
+    async def commit_work(self, work: UnitOfWork):
+        # none of the methods below yield to the event loop, so no other task can
+        # see the work half done. they only insert and delete rows, so if one fails
+        # restoring each table's row list and serial rolls everything back
+        backup = [
+            (table, list(table.rows), table.next_id) for table in self.tables.values()
+        ]
+        case_id = None
+        try:
+            for name, args in work.all_operations():
+                case_id = await getattr(self, name)(*args)
+        except BaseException:
+            for table, table_rows, next_id in backup:
+                table.rows = table_rows
+                table.next_id = next_id
+            raise
+        return case_id if work.log_entry else None
+
+    async def set_pending_action(
+        self,
+        user_id: int,
+        action_type: str,
+        roles_to_remove: list,
+        roles_to_add: list,
+        action_time: datetime.datetime,
+        add_to_log: bool = True,
+    ):
+        if action_type not in MOD_ACTIONS:
+            raise ValueError(f"invalid mod action type {action_type}")
+        self.tables["pending_actions"].insert(
+            user_id=user_id,
+            type=action_type,
+            roles_to_remove=roles_to_remove,
+            roles_to_add=roles_to_add,
+            action_time=action_time,
+            add_to_log=add_to_log,
+        )
+
+    async def delete_pending_action(self, action_id: int):
+        self.tables["pending_actions"].delete(lambda row: row.id == action_id)
+
+    async def get_pending_actions(self):
+        return self.tables["pending_actions"].select()
+
+    async def get_due_pending_actions(self):
+        now = utcnow()
+        return [
+            row
+            for row in self.tables["pending_actions"].select()
+            if row.action_time < now
+        ]
+
+    async def get_mute(self, user_id: int):
+        return self.first(
+            [
+                row
+                for row in self.tables["pending_actions"].select(user_id=user_id)
+                if row.type in ("mute", "hardmute")
+            ]
+        )
+
+    async def get_logs_for_user(self, user_id: int):
+        return self.tables["modactions"].select(user_id=user_id)
+
+    async def get_dossier(
+        self, user_id: int, action_limit: int = 5, note_limit: int = 5
+    ):
+        actions = self.tables["modactions"].select(user_id=user_id)
+        notes = self.tables["notes"].select(user_id=user_id)
+        pending = sorted(
+            self.tables["pending_actions"].select(user_id=user_id),
+            key=lambda row: row.action_time,
+            reverse=True,
+        )
+        return rows.Dossier(
+            len(actions),
+            [
+                json_row(row, ("id", "mod_id", "type", "reason", "created"))
+                for row in actions[::-1][:action_limit]
+            ],
+            len(notes),
+            [
+                json_row(row, ("id", "set_by", "reason", "created"))
+                for row in notes[::-1][:note_limit]
+            ],
+            json_row(pending[0], ("id", "type", "action_time")) if pending else None,
+            len(self.tables["tickets"].select(user_id=user_id, ticket_closed=False)),
+        )
+
+    # highlights
+
+    async def add_highlight(self, user_id: int, highlight: str):
+        self.tables["highlights"].insert(user_id=user_id, word=highlight)
+
+    async def remove_highlight(self, user_id: int, highlight: str):
+        self.tables["highlights"].delete(
+            lambda row: row.user_id == user_id and row.word == highlight
+        )
+
+    async def get_highlights_for_user(self, user_id: int):
+        return self.tables["highlights"].select(user_id=user_id)
+
+    async def get_all_highlights(self):
+        return self.tables["highlights"].select()
+
+    # ticket functions
+
+    async def get_ticket_settings(self):
+        return self.first(self.tables["tickets_config"].select())
+
+    async def set_ticket_channel(self, channel_id: int):
+        self.tables["tickets_config"].update({"listen_channel": channel_id}, id=1)
+
+    async def set_ticket_message(self, message_id: int):
+        self.tables["tickets_config"].update({"listen_message": message_id}, id=1)
+
+    async def add_ticket_channel(self, channel_id: int, user_id: int):
+        self.tables["tickets"].insert(
+            channel_id=channel_id, user_id=user_id, ticket_closed=False
+        )
+
+    async def remove_ticket_channel(self, channel_id: int):
+        self.tables["tickets"].delete(lambda row: row.channel_id == channel_id)
+
+    async def set_ticket_closed(self, channel_id: int, closed: bool):
+        self.tables["tickets"].update({"ticket_closed": closed}, channel_id=channel_id)
+
+    async def get_tickets_for_user(self, user_id: int) -> int:
+        return len(self.tables["tickets"].select(user_id=user_id))
+
+    async def count_open_tickets(self, user_id: int) -> int:
+        return len(self.tables["tickets"].select(user_id=user_id, ticket_closed=False))
+
+    async def get_ticket(self, channel_id):
+        return self.first(self.tables["tickets"].select(channel_id=channel_id))
+
+    # role functions
+
+    async def add_role(self, role_id: int):
+        self.tables["selfroles"].insert(role_id=role_id)
+
+    async def del_role(self, role_id: int):
+        self.tables["selfroles"].delete(lambda row: row.role_id == role_id)
+
+    async def fetch_roles(self) -> tuple:
+        return tuple(row.role_id for row in self.tables["selfroles"].select())
+
+    # lockdown functions
+
+    async def add_lockdown_snapshots(self, snapshots: list):
+        table = self.tables["lockdown_snapshots"]
+        for channel_id, overwrites in snapshots:
+            if not table.select(channel_id=channel_id):
+                table.insert(channel_id=channel_id, overwrites=overwrites)
+
+    async def get_lockdown_snapshots(self, channel_ids: list):
+        return [
+            rows.LockdownSnapshot(row.channel_id, row.overwrites)
+            for row in self.tables["lockdown_snapshots"].select()
+            if row.channel_id in channel_ids
+        ]
+
+    async def delete_lockdown_snapshots(self, channel_ids: list):
+        self.tables["lockdown_snapshots"].delete(
+            lambda row: row.channel_id in channel_ids
+        )
+
+    # word filter functions
+
+    async def add_filter_rule(
+        self, rule_type: str, pattern: str, action: str, added_by: int
+    ) -> int:
+        return self.tables["filter_rules"].insert(
+            type=rule_type, pattern=pattern, action=action, added_by=added_by
+        )[0]
+
+    async def remove_filter_rule(self, rule_id: int):
+        return self.first(
+            self.tables["filter_rules"].delete(lambda row: row.id == rule_id)
+        )
+
+    async def get_filter_rules(self):
+        return self.tables["filter_rules"].select()
+
+    # export commands
+
+    async def export_all(self):
+        return self.tables["modactions"].select()
+
+    async def export_user(self, user_id: int):
+        return self.tables["modactions"].select(user_id=user_id)
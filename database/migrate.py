@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import logging
+import os
+import re
+import time
+
+import psycopg2.errors
+
+logger = logging.getLogger("discord.database")
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+migration_file_match = re.compile(r"(\d+)\.sql")
+# migrations starting with this line are run outside of the transaction, one statement
+# at a time, for statements postgres before 12 refuses to run in a transaction or
+# multi-statement query (like `alter type ... add value`)
+NO_TRANSACTION = "-- migrate: no transaction"
+# migrations from before NO_TRANSACTION that need it. their files stay as they are,
+# since databases that already applied them compare the checksums
+NO_TRANSACTION_VERSIONS = {12}
+
+
+class Migration:
+    __slots__ = ("version", "path", "sql", "checksum", "transactional")
+
+    def __init__(self, version: int, path: str):
+        self.version = version
+        self.path = path
+        with open(path, "r") as sql_file:
+            self.sql = sql_file.read()
+        self.checksum = hashlib.sha256(self.sql.encode()).hexdigest()
+        self.transactional = not (
+            self.sql.startswith(NO_TRANSACTION) or version in NO_TRANSACTION_VERSIONS
+        )
+
+
+def discover_migrations(target_version: int, directory: str = MIGRATIONS_DIR) -> dict:
+    """Return the paths of all migrations up to target_version, by version."""
+    paths = {}
+    for name in os.listdir(directory):
+        match = migration_file_match.fullmatch(name)
+        if match and int(match.group(1)) <= target_version:
+            paths[int(match.group(1))] = os.path.join(directory, name)
+    missing = set(range(1, target_version + 1)) - set(paths)
+    if missing:
+        raise RuntimeError(
+            f"Missing migrations: {', '.join(str(version) for version in sorted(missing))}"
+        )
+    return paths
+
+
+async def get_schema_version(cur) -> int:
+    """Return the schema version of the database, or 0 if it isn't initialised."""
+    try:
+        await cur.execute("SELECT schema_version FROM info")
+    except psycopg2.errors.UndefinedTable:
+        return 0
+    return (await cur.fetchone())[0]
+
+
+async def migrate(conn, target_version: int):
+    """Bring the database schema up to target_version.
+
+    If the schema is current this is a single query, without touching the
+    migration files. Otherwise all pending migrations are applied in one
+    transaction, so a failing migration leaves the schema as it was, and
+    the checksum of every applied migration is recorded in schema_migrations.
+    """
+    async with conn.cursor() as cur:
+        schema_version = await get_schema_version(cur)
+        if schema_version >= target_version:
+            return schema_version
+
+        paths = discover_migrations(target_version)
+        pending = [
+            Migration(version, paths[version])
+            for version in range(schema_version + 1, target_version + 1)
+        ]
+        logger.log(
+            logging.INFO,
+            f"Migrating database schema from version {schema_version} to {target_version}",
+        )
+        start = time.perf_counter()
+        await cur.execute("BEGIN")
+        try:
+            await cur.execute(
+                "CREATE TABLE IF NOT EXISTS schema_migrations (version int primary key, checksum text not null, applied timestamp not null default (current_timestamp at time zone 'utc'), duration real)"
+            )
+            await check_applied(cur, paths, schema_version)
+            for migration in pending:
+                if migration.transactional:
+                    await apply(cur, migration)
+                else:
+                    # commit what we have so far, run this one on its own, and carry on
+                    await cur.execute("COMMIT")
+                    await apply(cur, migration)
+                    await cur.execute("BEGIN")
+            await cur.execute("COMMIT")
+        except BaseException:
+            await cur.execute("ROLLBACK")
+            raise
+        logger.log(
+            logging.INFO,
+            f"Applied {len(pending)} migrations in {(time.perf_counter() - start) * 1000:.1f}ms",
+        )
+        return target_version
+
+
+async def apply(cur, migration: Migration):
+    start = time.perf_counter()
+    if migration.transactional:
+        await cur.execute(migration.sql)
+    else:
+        for statement in migration.sql.split(";"):
+            if statement.strip():
+                await cur.execute(statement)
+    duration = (time.perf_counter() - start) * 1000
+    await cur.execute(
+        "INSERT INTO schema_migrations (version, checksum, duration) VALUES (%s, %s, %s) ON CONFLICT (version) DO UPDATE SET checksum = excluded.checksum, applied = excluded.applied, duration = excluded.duration",
+        (migration.version, migration.checksum, duration),
+    )
+    logger.log(
+        logging.INFO, f"Applied migration {migration.version} in {duration:.1f}ms"
+    )
+
+
+async def check_applied(cur, paths: dict, schema_version: int):
+    # migrations applied before checksums were recorded get the checksum of their file as it is now
+    await cur.execute("SELECT version, checksum FROM schema_migrations")
+    recorded = {row[0]: row[1] for row in await cur.fetchall()}
+    for version in range(1, schema_version + 1):
+        migration = Migration(version, paths[version])
+        if version not in recorded:
+            await cur.execute(
+                "INSERT INTO schema_migrations (version, checksum) VALUES (%s, %s)",
+                (version, migration.checksum),
+            )
+        elif recorded[version] != migration.checksum:
+            logger.log(
+                logging.WARN,
+                f"Migration {version} was changed after it was applied to this database",
+            )
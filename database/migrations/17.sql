@@ -0,0 +1,8 @@
+create table if not exists lockdown_snapshots
+(
+    channel_id  bigint primary key,
+    overwrites  jsonb not null,
+    created     timestamp not null default (current_timestamp at time zone 'utc')
+);
+
+update info set schema_version = 17;
@@ -0,0 +1,11 @@
+create table if not exists filter_rules
+(
+    id          serial primary key,
+    type        text not null, -- 'word', 'wildcard' or 'invite'
+    pattern     text not null,
+    action      text not null, -- 'delete', 'warn' or 'mute'
+    added_by    bigint,
+    created     timestamp not null default (current_timestamp at time zone 'utc')
+);
+
+update info set schema_version = 18;
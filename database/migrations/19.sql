@@ -0,0 +1,13 @@
+create index if not exists notes_user_id_idx on notes (user_id);
+create index if not exists modactions_user_id_idx on modactions (user_id);
+create index if not exists highlights_user_id_idx on highlights (user_id);
+create index if not exists tickets_user_id_idx on tickets (user_id);
+-- migration 5 replaced the channel_id primary key with a serial id
+create index if not exists tickets_channel_id_idx on tickets (channel_id);
+create index if not exists interviews_channel_id_idx on interviews (channel_id);
+create index if not exists blacklisted_channels_channel_id_idx on blacklisted_channels (channel_id);
+create index if not exists starboard_messages_starboard_id_idx on starboard_messages (starboard_id);
+create index if not exists pending_actions_action_time_idx on pending_actions (action_time);
+create index if not exists pending_actions_user_id_idx on pending_actions (user_id);
+
+update info set schema_version = 19;
@@ -0,0 +1,41 @@
+-- tell running bots which cached rows changed, see PostgresConn._listen_for_invalidations
+-- the optional trigger argument names the column cache entries are keyed by
+create or replace function notify_cache_invalidation() returns trigger as $$
+declare
+    new_key text;
+    old_key text;
+begin
+    if TG_NARGS > 0 then
+        if TG_OP <> 'DELETE' then
+            new_key := row_to_json(NEW) ->> TG_ARGV[0];
+        end if;
+        if TG_OP <> 'INSERT' then
+            old_key := row_to_json(OLD) ->> TG_ARGV[0];
+        end if;
+    end if;
+    if TG_OP <> 'DELETE' then
+        perform pg_notify('cache_invalidation', json_build_object('table', TG_TABLE_NAME, 'key', new_key)::text);
+    end if;
+    if TG_OP = 'DELETE' or old_key is distinct from new_key then
+        perform pg_notify('cache_invalidation', json_build_object('table', TG_TABLE_NAME, 'key', old_key)::text);
+    end if;
+    return null;
+end;
+$$ language plpgsql;
+
+create trigger starboard_cache_invalidation after insert or update or delete on starboard
+    for each row execute procedure notify_cache_invalidation();
+create trigger tickets_config_cache_invalidation after insert or update or delete on tickets_config
+    for each row execute procedure notify_cache_invalidation();
+create trigger blacklisted_channels_cache_invalidation after insert or update or delete on blacklisted_channels
+    for each row execute procedure notify_cache_invalidation();
+create trigger selfroles_cache_invalidation after insert or update or delete on selfroles
+    for each row execute procedure notify_cache_invalidation();
+create trigger highlights_cache_invalidation after insert or update or delete on highlights
+    for each row execute procedure notify_cache_invalidation('user_id');
+create trigger interviews_cache_invalidation after insert or update or delete on interviews
+    for each row execute procedure notify_cache_invalidation('channel_id');
+create trigger tickets_cache_invalidation after insert or update or delete on tickets
+    for each row execute procedure notify_cache_invalidation('channel_id');
+
+update info set schema_version = 20;
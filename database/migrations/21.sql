@@ -0,0 +1,16 @@
+-- work the bot does later, which has to survive restarts, see Interviews.run_delayed_jobs
+create table if not exists delayed_jobs
+(
+    id          serial primary key,
+    type        text not null, -- 'archive' or 'kick_and_archive'
+    channel_id  bigint not null,
+    user_id     bigint not null,
+    message_id  bigint, -- the countdown message
+    step        int not null default 0,
+    run_at      timestamp not null
+);
+
+create index if not exists delayed_jobs_run_at_idx on delayed_jobs (run_at);
+create index if not exists delayed_jobs_channel_id_idx on delayed_jobs (channel_id);
+
+update info set schema_version = 21;
@@ -0,0 +1,6 @@
+-- whether the interview questions were copied from the config yet, see Interviews.setup_questions.
+-- databases that already have questions don't need copying
+alter table info add column if not exists interview_questions_seeded boolean not null default false;
+update info set interview_questions_seeded = exists (select 1 from interview_questions);
+
+update info set schema_version = 22;
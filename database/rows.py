@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+
+# one row class per table, with the columns in the order the migrations create them,
+# so both positional (row[1]) and attribute (row.user_id) access work. they're tuples
+# underneath, so a row costs no more memory than its values
+
+
+Interview = collections.namedtuple(
+    "Interview", ("user_id", "channel_id", "current_question", "welcome_message")
+)
+InterviewQuestion = collections.namedtuple("InterviewQuestion", ("id", "question"))
+Note = collections.namedtuple("Note", ("id", "user_id", "set_by", "reason", "created"))
+ModAction = collections.namedtuple(
+    "ModAction", ("id", "user_id", "mod_id", "type", "reason", "created", "duration")
+)
+Ticket = collections.namedtuple(
+    "Ticket", ("channel_id", "user_id", "id", "ticket_closed")
+)
+StarboardSettings = collections.namedtuple(
+    "StarboardSettings", ("id", "channel", "star_limit", "emoji")
+)
+StarboardMessage = collections.namedtuple(
+    "StarboardMessage", ("message_id", "starboard_id")
+)
+PendingAction = collections.namedtuple(
+    "PendingAction",
+    (
+        "id",
+        "type",
+        "roles_to_remove",
+        "roles_to_add",
+        "action_time",
+        "user_id",
+        "add_to_log",
+    ),
+)
+Highlight = collections.namedtuple("Highlight", ("id", "user_id", "word"))
+TicketSettings = collections.namedtuple(
+    "TicketSettings",
+    ("id", "listen_channel", "listen_message", "listen_reaction", "welcome_message"),
+)
+LockdownSnapshot = collections.namedtuple(
+    "LockdownSnapshot", ("channel_id", "overwrites")
+)
+DelayedJob = collections.namedtuple(
+    "DelayedJob",
+    ("id", "type", "channel_id", "user_id", "message_id", "step", "run_at"),
+)
+FilterRule = collections.namedtuple(
+    "FilterRule", ("id", "type", "pattern", "action", "added_by", "created")
+)
+Dossier = collections.namedtuple(
+    "Dossier",
+    (
+        "action_count",
+        "actions",
+        "note_count",
+        "notes",
+        "pending_action",
+        "ticket_count",
+    ),
+)
+
+
+def one(row_class, row):
+    return row_class._make(row) if row is not None else None
+
+
+def many(row_class, rows) -> list:
+    return list(map(row_class._make, rows))
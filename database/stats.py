@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import math
+import time
+
+logger = logging.getLogger("discord.database")
+
+# the query (method call) currently running in this task
+current_query = contextvars.ContextVar("current_query", default=None)
+
+
+class Histogram:
+    """A fixed-size histogram with logarithmic buckets.
+
+    Bucket 0 holds values below `smallest`, every bucket after that is `growth`
+    times wider than the previous one, so percentiles are accurate to within
+    one bucket no matter how many values are recorded.
+    """
+
+    __slots__ = ("smallest", "growth", "counts", "count")
+
+    def __init__(self, smallest: float, growth: float = 1.25, buckets: int = 64):
+        self.smallest = smallest
+        self.growth = growth
+        self.counts = [0] * buckets
+        self.count = 0
+
+    def add(self, value: float):
+        if value < self.smallest:
+            index = 0
+        else:
+            index = min(
+                int(math.log(value / self.smallest, self.growth)) + 1,
+                len(self.counts) - 1,
+            )
+        self.counts[index] += 1
+        self.count += 1
+
+    def percentile(self, percentile: float) -> float:
+        """Return the upper bound of the bucket the given percentile (0-100) falls in."""
+        if not self.count:
+            return 0
+        target = self.count * percentile / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.smallest * self.growth**index
+        return self.smallest * self.growth ** (len(self.counts) - 1)
+
+
+class QueryStats:
+    """Pool wait, execute time (both in milliseconds) and row counts for one method."""
+
+    __slots__ = ("calls", "acquire", "execute", "rows")
+
+    def __init__(self):
+        self.calls = 0
+        self.acquire = Histogram(0.01)
+        self.execute = Histogram(0.01)
+        self.rows = Histogram(1, growth=2, buckets=24)
+
+
+class QueryTimer:
+    __slots__ = ("acquire", "execute", "rows")
+
+    def __init__(self):
+        self.acquire = 0.0
+        self.execute = 0.0
+        self.rows = 0
+
+
+class DatabaseStats:
+    def __init__(self, slow_query_threshold: float = 0):
+        self.queries = {}
+        # in milliseconds, 0 disables slow query logging
+        self.slow_query_threshold = slow_query_threshold
+
+    def record(self, name: str, timer: QueryTimer):
+        stats = self.queries.get(name)
+        if stats is None:
+            stats = self.queries[name] = QueryStats()
+        stats.calls += 1
+        stats.acquire.add(timer.acquire * 1000)
+        stats.execute.add(timer.execute * 1000)
+        stats.rows.add(timer.rows)
+        if (
+            self.slow_query_threshold
+            and (timer.acquire + timer.execute) * 1000 >= self.slow_query_threshold
+        ):
+            logger.log(
+                logging.WARN,
+                f"Slow query {name}: waited {timer.acquire * 1000:.1f}ms for a connection, executed in {timer.execute * 1000:.1f}ms, {timer.rows} rows",
+            )
+
+
+def instrument(cls):
+    """Class decorator that times every public coroutine method of a DatabaseConn."""
+    for name, method in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(method):
+            continue
+        setattr(cls, name, timed(name, method))
+    return cls
+
+
+def timed(name: str, method):
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        timer = QueryTimer()
+        token = current_query.set(timer)
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            current_query.reset(token)
+            self.stats.record(name, timer)
+
+    return wrapper
+
+
+class TimedConnection:
+    """Wraps a pool connection so its cursors record execute time and rows."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    @contextlib.asynccontextmanager
+    async def cursor(self, *args, **kwargs):
+        async with self.conn.cursor(*args, **kwargs) as cur:
+            yield TimedCursor(cur)
+
+
+class TimedCursor:
+    def __init__(self, cur):
+        self.cur = cur
+
+    def __getattr__(self, name):
+        return getattr(self.cur, name)
+
+    async def execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self.cur.execute(*args, **kwargs)
+        finally:
+            timer = current_query.get()
+            if timer:
+                timer.execute += time.perf_counter() - start
+                timer.rows += max(self.cur.rowcount, 0)
+
+
+@contextlib.asynccontextmanager
+async def timed_acquire(pool, timeout: float = None):
+    start = time.perf_counter()
+    # raises asyncio.TimeoutError if no connection frees up in time
+    conn = await asyncio.wait_for(pool.acquire(), timeout)
+    try:
+        timer = current_query.get()
+        if timer:
+            timer.acquire += time.perf_counter() - start
+        yield TimedConnection(conn)
+    finally:
+        await pool.release(conn)
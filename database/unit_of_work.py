@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import datetime
+
+
+class UnitOfWork:
+    """Moderation writes to apply together, see DatabaseConn.commit_work.
+
+    Writes are only queued here as (DatabaseConn method name, arguments),
+    nothing touches the database until the unit of work is committed. The mod
+    log entry is always written last, so its id (the case number) is what the
+    commit returns.
+    """
+
+    def __init__(self):
+        self.operations = []
+        self.log_entry = None
+
+    def set_pending_action(
+        self,
+        user_id: int,
+        action_type: str,
+        roles_to_remove: list,
+        roles_to_add: list,
+        action_time: datetime.datetime,
+        add_to_log: bool = True,
+    ):
+        self.operations.append(
+            (
+                "set_pending_action",
+                (
+                    user_id,
+                    action_type,
+                    roles_to_remove,
+                    roles_to_add,
+                    action_time,
+                    add_to_log,
+                ),
+            )
+        )
+        return self
+
+    def delete_pending_action(self, action_id: int):
+        self.operations.append(("delete_pending_action", (action_id,)))
+        return self
+
+    def add_to_mod_logs(self, user_id: int, mod_id: int, action_type: str, reason: str):
+        if self.log_entry:
+            raise ValueError("a unit of work can only add one mod log entry")
+        self.log_entry = ("add_to_mod_logs", (user_id, mod_id, action_type, reason))
+        return self
+
+    def all_operations(self) -> list:
+        if self.log_entry:
+            return self.operations + [self.log_entry]
+        return self.operations
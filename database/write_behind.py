@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+
+logger = logging.getLogger("discord.database")
+
+
+class WriteBehindBuffer:
+    """Writes that don't need to happen right away, flushed in batches.
+
+    Writes are keyed by (kind, key), so repeated writes to the same key before
+    a flush are coalesced into the latest one. It's flushed every `interval`
+    seconds, and by close() on shutdown. Once it holds `maxsize` keys, put()
+    flushes before returning (after any flush that's already running), so
+    writers slow down to the database's pace instead of the buffer growing.
+
+    While a batch is being written, get() still returns its writes, and once
+    it's committed `flushed` (if given) is called with its (kind, key) pairs,
+    so readers never fall back to the rows from before the batch.
+
+    `flush_batch` is a coroutine taking {kind: [args, ...]}. If it fails the
+    batch is put back to be retried on the next flush, unless newer writes
+    to the same keys arrived in the meantime. If the database stays down the
+    oldest writes are dropped rather than letting the buffer grow forever.
+    """
+
+    def __init__(
+        self, flush_batch, maxsize: int = 1000, interval: float = 5, flushed=None
+    ):
+        self.flush_batch = flush_batch
+        self.flushed = flushed
+        self.maxsize = maxsize
+        self.interval = interval
+        self.pending = {}
+        # the batch currently being written
+        self.in_flight = {}
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.flush_periodically())
+
+    async def put(self, kind: str, key, args: tuple):
+        self.pending.pop((kind, key), None)
+        self.pending[(kind, key)] = args
+        if len(self.pending) >= self.maxsize:
+            # shielded, so a cancelled writer doesn't lose the batch halfway through
+            await asyncio.shield(self.flush())
+
+    def get(self, kind: str, key):
+        """Return the arguments of the write buffered (or being written) for this key, or None."""
+        args = self.pending.get((kind, key))
+        if args is None:
+            args = self.in_flight.get((kind, key))
+        return args
+
+    def discard(self, kind: str, key):
+        # for when a synchronous write supersedes the buffered one
+        self.pending.pop((kind, key), None)
+        self.in_flight.pop((kind, key), None)
+
+    async def flush(self):
+        async with self.lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+            self.in_flight = batch
+            writes = {}
+            for (kind, _), args in batch.items():
+                writes.setdefault(kind, []).append(args)
+            try:
+                await self.flush_batch(writes)
+            except Exception as e:
+                self.in_flight = {}
+                dropped = 0
+                for item_key, args in batch.items():
+                    if len(self.pending) >= self.maxsize:
+                        dropped += 1
+                    else:
+                        self.pending.setdefault(item_key, args)
+                logger.log(
+                    logging.WARN,
+                    f"Flushing {len(batch)} buffered writes failed, retrying later ({dropped} dropped): {e}",
+                )
+            else:
+                self.in_flight = {}
+                if self.flushed:
+                    self.flushed(list(batch))
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            # shielded, so close() cancelling this loop lets a batch being written finish
+            await asyncio.shield(self.flush())
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+        # waits for the lock, so a flush that's still running finishes first
+        await self.flush()
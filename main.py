@@ -25,6 +25,7 @@ import tomlkit
 from discord.ext import commands
 
 from bot import (
+    automod,
     gatekeeper,
     highlight,
     interviews,
@@ -33,9 +34,10 @@ from bot import (
     starboard,
     tickets,
     user_commands,
+    wordfilter,
     helpcommand,
 )
-from database import database as botdb
+import database as botdb
 
 config_file = Path("config.toml")
 
@@ -60,7 +62,16 @@ logger.addHandler(handler)
 
 description = "General-purpose moderation bot for the Cove"
 
-bot = commands.Bot(
+
+class CoveBot(commands.Bot):
+    async def close(self):
+        # write out anything the database is still buffering before exiting
+        if conn:
+            await conn.close()
+        await super().close()
+
+
+bot = CoveBot(
     command_prefix=commands.when_mentioned_or(*bot_config["bot"]["prefixes"]),
     description=description,
     case_insensitive=True,
@@ -95,7 +106,12 @@ async def on_ready():
 
     global loaded_cogs
     global conn
-    conn = await botdb.init_dbconn(bot_config["bot"]["database_url"])
+    # on_ready runs again after reconnecting, but the database connection survives that
+    if not conn:
+        conn = await botdb.init_dbconn(
+            bot_config["bot"]["database_url"],
+            bot_config.get("database", {}),
+        )
     global starboard_settings
     starboard_settings = await conn.get_starboard_settings()
 
@@ -119,7 +135,11 @@ async def on_ready():
             )
         if bot_config["cogs"]["enable_highlights"]:
             bot.add_cog(highlight.Highlights(bot, conn, logger))
-        if bot_config["cogs"]["enable_tickets"]:
+        if bot_config["cogs"].get("enable_automod", False):
+            bot.add_cog(automod.Automod(bot, conn, bot_config, logger))
+        if bot_config["cogs"].get("enable_filter", False):
+            bot.add_cog(wordfilter.WordFilter(bot, conn, bot_config, logger))
+        if bot_config["cogs"].get("enable_tickets", False):
             bot.add_cog(
                 tickets.Tickets(
                     bot, conn, await conn.get_ticket_settings(), bot_config, logger
@@ -136,4 +156,5 @@ async def on_ready():
 
 
 loaded_cogs = False
+conn = None
 bot.run(bot_config["bot"]["token"])
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import os
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+from database import init_dbconn
+
+
+@pytest.fixture(scope="session")
+def database_url():
+    """A scratch database on the server in COVEBOT_TEST_DATABASE_URL, dropped after the tests."""
+    server_url = os.environ.get("COVEBOT_TEST_DATABASE_URL")
+    if not server_url:
+        pytest.skip("COVEBOT_TEST_DATABASE_URL isn't set")
+    name = f"covebot_test_{os.getpid()}"
+    admin = psycopg2.connect(server_url)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f"CREATE DATABASE {name}")
+    try:
+        yield psycopg2.extensions.make_dsn(server_url, dbname=name)
+    finally:
+        with admin.cursor() as cur:
+            cur.execute(f"DROP DATABASE {name}")
+        admin.close()
+
+
+@pytest.fixture
+def postgres(database_url):
+    """Return a function running a coroutine function with a PostgresConn on the scratch database."""
+
+    def run(test):
+        async def with_conn():
+            conn = await init_dbconn(database_url, {"health_check_interval": 0})
+            try:
+                return await test(conn)
+            finally:
+                await conn.close()
+
+        return asyncio.run(with_conn())
+
+    return run
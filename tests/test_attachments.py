@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import logging
+import types
+
+import aiohttp
+
+from bot.attachments import ArchiveStats, AttachmentArchiver
+
+logger = logging.getLogger("discord")
+
+
+class FailingSession:
+    """An aiohttp session whose every request fails."""
+
+    def get(self, url):
+        raise aiohttp.ClientConnectionError(f"can't connect to {url}")
+
+    async def close(self):
+        pass
+
+
+def test_from_config_without_attachments_section():
+    assert AttachmentArchiver.from_config({"bot": {}}, logger) is None
+
+
+def test_failed_downloads_release_their_reservation(tmp_path):
+    async def check():
+        archiver = AttachmentArchiver(str(tmp_path), 2, 1000, logger)
+        await archiver.session.close()
+        archiver.session = FailingSession()
+        stats = ArchiveStats()
+        for i in range(5):
+            attachment = types.SimpleNamespace(
+                id=i, url=f"https://example.com/{i}", size=600
+            )
+            assert await archiver.download(attachment, stats) is None
+        # each one failed instead of the later ones being skipped as over the cap
+        assert (stats.failed, stats.skipped, stats.reserved) == (5, 0, 0)
+
+    asyncio.run(check())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import datetime
+
+import psycopg2
+import pytest
+
+from database.unit_of_work import UnitOfWork
+
+
+def test_commit_work(postgres):
+    async def check(conn):
+        action_time = datetime.datetime(2030, 1, 1)
+        case_id = await conn.commit_work(
+            UnitOfWork()
+            .set_pending_action(1001, "mute", [1], [2], action_time)
+            .add_to_mod_logs(1001, 2001, "mute", "testing")
+        )
+        assert [entry.id for entry in await conn.export_user(1001)] == [case_id]
+        (action,) = [
+            action
+            for action in await conn.get_pending_actions()
+            if action.user_id == 1001
+        ]
+        assert action.action_time == action_time
+
+        # the pending action is removed and the unmute logged together
+        assert (
+            await conn.commit_work(
+                UnitOfWork()
+                .delete_pending_action(action.id)
+                .add_to_mod_logs(1001, 2001, "unmute", "testing")
+            )
+            > case_id
+        )
+        assert len(await conn.export_user(1001)) == 2
+        assert 1001 not in [
+            action.user_id for action in await conn.get_pending_actions()
+        ]
+
+    postgres(check)
+
+
+def test_commit_work_is_atomic(postgres):
+    async def check(conn):
+        work = (
+            UnitOfWork()
+            .set_pending_action(1002, "mute", [], [], datetime.datetime(2030, 1, 1))
+            .add_to_mod_logs(1002, 2001, "not an action", "testing")
+        )
+        with pytest.raises(psycopg2.Error):
+            await conn.commit_work(work)
+        assert 1002 not in [
+            action.user_id for action in await conn.get_pending_actions()
+        ]
+        assert await conn.export_user(1002) == []
+
+    postgres(check)
+
+
+def test_write_behind_flush(postgres):
+    async def check(conn):
+        await conn.create_interview(1003, 3003, 4003)
+        await conn.queue_increment_question(2, 3003)
+        assert (await conn.get_interview_from_channel(3003)).current_question == 2
+        await conn.write_behind.flush()
+        assert not conn.write_behind.pending and not conn.write_behind.in_flight
+        assert (await conn.get_interview(1003)).current_question == 2
+
+    postgres(check)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""EXPLAIN every query PostgresConn runs, and fail on sequential scans of large tables.
+
+The queries aren't listed here: every DatabaseConn method is called on a
+PostgresConn with made up arguments, and whatever the methods execute is
+recorded, so new methods are checked without touching this test. The tables
+are filled with ROWS generated rows first, and analyzed, so the planner picks
+the plans it would on a large guild's database.
+"""
+
+import datetime
+import inspect
+import json
+
+import psycopg2
+import pytest
+
+from database import stats
+from database.base import DatabaseConn
+from database.unit_of_work import UnitOfWork
+
+ROWS = 10000
+# a sequential scan with a filter over a table estimated larger than this fails
+SEQ_SCAN_MAX_ROWS = 1000
+# bigint columns are ids, kept clear of the ones the other tests use
+ID_OFFSET = 10**12
+# tables that only ever hold one row
+SKIP_TABLES = {"info", "schema_migrations"}
+
+# arguments that have to be valid values, by parameter name
+ARGUMENTS = {
+    "action_type": "mute",
+    "job_type": "archive",
+    "rule_type": "word",
+    "action": "delete",
+    "emoji": "⭐",
+    "questions": ["Why are you here?"],
+    "channel_ids": [42],
+    "snapshots": [(42, {"42": [0, 0]})],
+    "work": UnitOfWork()
+    .delete_pending_action(42)
+    .add_to_mod_logs(42, 42, "unmute", "testing"),
+}
+# and otherwise by annotation
+ANNOTATIONS = {
+    int: 42,
+    str: "test",
+    bool: True,
+    list: [],
+    datetime.datetime: datetime.datetime(2030, 1, 1),
+}
+
+
+def column_value(data_type: str, udt_name: str) -> str:
+    """Return the SQL generating the value of a column of this type for row i."""
+    if data_type == "bigint":
+        return f"i + {ID_OFFSET}"
+    if data_type in ("integer", "smallint", "real", "double precision", "numeric"):
+        return "i"
+    if data_type in ("text", "character varying"):
+        return "'row ' || i"
+    if data_type == "boolean":
+        return "i % 2 = 0"
+    if data_type.startswith("timestamp"):
+        return "(current_timestamp at time zone 'utc') + i * interval '1 minute'"
+    if data_type == "ARRAY":
+        return "'{}'"
+    if data_type in ("json", "jsonb"):
+        return "'{}'"
+    if data_type == "USER-DEFINED":
+        return f"(enum_range(NULL::{udt_name}))[1]"
+    raise ValueError(f"no generated values for {data_type} columns")
+
+
+def fill_tables(database_url: str) -> set:
+    """Fill every table with ROWS rows, returning the tables that were filled."""
+    filled = set()
+    conn = psycopg2.connect(database_url)
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT table_name, column_name, data_type, udt_name, column_default FROM information_schema.columns WHERE table_schema = 'public' ORDER BY table_name, ordinal_position"
+        )
+        tables = {}
+        for table, column, data_type, udt_name, default in cur.fetchall():
+            # serial columns fill themselves
+            if default and default.startswith("nextval("):
+                continue
+            tables.setdefault(table, []).append(
+                (column, column_value(data_type, udt_name))
+            )
+        for table, columns in tables.items():
+            if table in SKIP_TABLES:
+                continue
+            try:
+                cur.execute(
+                    f"INSERT INTO {table} ({', '.join(column for column, _ in columns)}) SELECT {', '.join(value for _, value in columns)} FROM generate_series(1, {ROWS}) i"
+                )
+                filled.add(table)
+            except psycopg2.IntegrityError:
+                # single row settings tables, which stay small anyway
+                pass
+        cur.execute("ANALYZE")
+    finally:
+        conn.close()
+    return filled
+
+
+def arguments(method) -> list:
+    args = []
+    for name, parameter in list(inspect.signature(method).parameters.items())[1:]:
+        if parameter.default is not inspect.Parameter.empty:
+            break
+        if name in ARGUMENTS:
+            args.append(ARGUMENTS[name])
+        else:
+            args.append(ANNOTATIONS.get(parameter.annotation, 42))
+    return args
+
+
+async def run_all_methods(conn) -> list:
+    """Call every DatabaseConn method, returning the (query, parameters) they executed."""
+    executed = []
+    execute = stats.TimedCursor.execute
+
+    async def recording_execute(self, query, parameters=None, *args, **kwargs):
+        executed.append((query, parameters))
+        return await execute(self, query, parameters, *args, **kwargs)
+
+    stats.TimedCursor.execute = recording_execute
+    try:
+        for name, method in vars(DatabaseConn).items():
+            if name.startswith("_") or name == "close":
+                continue
+            if inspect.iscoroutinefunction(method):
+                await getattr(conn, name)(*arguments(method))
+        # and the batched writes queued above
+        await conn.write_behind.flush()
+    finally:
+        stats.TimedCursor.execute = execute
+    return executed
+
+
+def statements(executed: list) -> list:
+    """Split the recorded queries into the statements EXPLAIN accepts."""
+    result = []
+    for query, parameters in executed:
+        if isinstance(query, bytes):
+            query = query.decode()
+        # commit_work and write-behind flushes send several statements in one query
+        parts = query.split(";\n") if parameters is None else [query]
+        for part in parts:
+            if part.lstrip().split(None, 1)[0].upper() in (
+                "SELECT",
+                "INSERT",
+                "UPDATE",
+                "DELETE",
+                "WITH",
+            ):
+                result.append((part, parameters))
+    return result
+
+
+def seq_scans(plan: dict):
+    """Yield the filtered sequential scans in an EXPLAIN (FORMAT JSON) plan."""
+    # unfiltered scans read the whole table on purpose, an index wouldn't help them
+    if plan["Node Type"] == "Seq Scan" and "Filter" in plan:
+        yield plan
+    for subplan in plan.get("Plans", ()):
+        yield from seq_scans(subplan)
+
+
+def test_no_large_seq_scans(database_url, postgres):
+    async def fill_and_run(conn):
+        # the tables only exist once the PostgresConn has migrated the database
+        return fill_tables(database_url), await run_all_methods(conn)
+
+    filled, executed = postgres(fill_and_run)
+    assert {"interviews", "modactions", "notes", "tickets"} <= filled
+    checked = set()
+    failures = []
+    conn = psycopg2.connect(database_url)
+    try:
+        cur = conn.cursor()
+        for query, parameters in statements(executed):
+            if query in checked:
+                continue
+            checked.add(query)
+            cur.execute("EXPLAIN (FORMAT JSON) " + query, parameters)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            for scan in seq_scans(plan[0]["Plan"]):
+                cur.execute(
+                    "SELECT reltuples FROM pg_class WHERE relname = %s",
+                    (scan["Relation Name"],),
+                )
+                table_rows = cur.fetchone()[0]
+                if table_rows > SEQ_SCAN_MAX_ROWS:
+                    failures.append(
+                        f"{query}\n  scans {scan['Relation Name']} ({table_rows:.0f} rows) filtering on {scan['Filter']}"
+                    )
+    finally:
+        conn.close()
+    assert len(checked) > 50
+    assert not failures, "\n".join(failures)
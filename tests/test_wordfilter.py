@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from bot.wordfilter import FilterMatcher
+
+
+def test_invite_rules_match_in_id_order():
+    matcher = FilterMatcher()
+    matcher.add(5, "invite", "*", "delete")
+    matcher.add(6, "invite", "abc", "mute")
+    assert matcher.match("join discord.gg/abc") == (5, "delete")
+    assert matcher.match("join discord.gg/xyz") == (5, "delete")
+    matcher.remove(5)
+    assert matcher.match("join discord.gg/abc") == (6, "mute")
+    assert matcher.match("join discord.gg/xyz") is None
+
+
+def test_first_matching_rule_wins():
+    matcher = FilterMatcher()
+    matcher.add(1, "wildcard", "sp*m", "warn")
+    matcher.add(2, "word", "spam", "mute")
+    matcher.add(3, "word", "eggs", "delete")
+    assert matcher.match("eggs and spam") == (1, "warn")
+    assert matcher.match("eggs and spum") == (1, "warn")
+    assert matcher.match("just eggs") == (3, "delete")
+    assert matcher.match("nothing here") is None
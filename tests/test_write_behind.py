@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# CoveBot: Discord bot for a simple interview gatekeeper
+# Copyright (C) 2020 Starshine113 (Starshine System)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+
+from database.write_behind import WriteBehindBuffer
+
+
+class SlowDatabase:
+    """A flush_batch that takes a while, recording the batches it wrote."""
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.batches = []
+
+    async def flush_batch(self, writes: dict):
+        await asyncio.sleep(self.delay)
+        self.batches.append(writes)
+
+
+def test_put_waits_for_the_flush_when_full():
+    async def check():
+        database = SlowDatabase()
+        buffer = WriteBehindBuffer(database.flush_batch, maxsize=10, interval=60)
+        for key in range(95):
+            await buffer.put("increment_question", key, (1, key))
+            assert len(buffer.pending) < 10
+        assert sum(len(batch["increment_question"]) for batch in database.batches) == 90
+        await buffer.close()
+        assert sum(len(batch["increment_question"]) for batch in database.batches) == 95
+
+    asyncio.run(check())
+
+
+def test_close_finishes_the_running_flush():
+    async def check():
+        database = SlowDatabase()
+        buffer = WriteBehindBuffer(database.flush_batch, interval=0.01)
+        buffer.start()
+        await buffer.put("increment_question", 1, (2, 1))
+        # the periodic flush is now halfway through writing the batch
+        await asyncio.sleep(0.03)
+        assert buffer.in_flight
+        await buffer.put("increment_question", 2, (3, 2))
+        await buffer.close()
+        assert database.batches == [
+            {"increment_question": [(2, 1)]},
+            {"increment_question": [(3, 2)]},
+        ]
+
+    asyncio.run(check())